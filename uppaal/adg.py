@@ -1,4 +1,6 @@
 from enum import Enum
+import functools
+import hashlib
 
 
 class NodeType(Enum):
@@ -13,6 +15,19 @@ class OperationType(Enum):
 
 
 class Node:
+    """Node of an ADG, identified by its name. id is its index in the ADG (see
+    ADG.indexed_nodes), set when the ADG is built."""
+
+    __slots__ = (
+        "parents",
+        "defenses",
+        "node_type",
+        "attack_childern",
+        "subgoal_children",
+        "name",
+        "id",
+    )
+
     def __init__(
         self,
         parents=None,
@@ -28,6 +43,7 @@ class Node:
         self.attack_childern = attack_childern if attack_childern else []
         self.subgoal_children = subgoal_children if subgoal_children else []
         self.name = name if name else f"{self.node_type}:{id(self)}"
+        self.id = None
 
     def __str__(self):
         return self.name
@@ -45,10 +61,13 @@ class Node:
         return self.name > other.name
 
     def __eq__(self, other):
-        return self.name == other.name
+        return self is other or self.name == other.name
 
     def __ne__(self, other):
-        return self.name != other.name
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.name)
 
     def get_children(self):
         return self.attack_childern + self.subgoal_children
@@ -61,27 +80,37 @@ class Node:
         for child in self.get_children() + self.defenses:
             child.set_parents(self)
 
-    def dfs(self, visited):
+    def dfs(self, visited, seen=None):
+        """Append the descendants to the visited list in dfs order, seen being the
+        set of the visited nodes."""
+        seen = set(visited) if seen is None else seen
         for child in self.get_children():
-            if child not in visited:
+            if child not in seen:
+                seen.add(child)
                 visited.append(child)
-                child.dfs(visited)
+                child.dfs(visited, seen)
 
-    def dfs_parents(self, visited):
+    def dfs_parents(self, visited, seen=None):
+        seen = set(visited) if seen is None else seen
         for parent in self.parents:
-            if parent not in visited:
+            if parent not in seen:
+                seen.add(parent)
                 visited.append(parent)
-                parent.dfs_parents(visited)
+                parent.dfs_parents(visited, seen)
 
-    def dfs_defenses(self, defenses):
+    def dfs_defenses(self, defenses, seen=None):
+        seen = set(defenses) if seen is None else seen
         for defense in self.defenses:
-            if defense not in defenses:
+            if defense not in seen:
+                seen.add(defense)
                 defenses.append(defense)
         for child in self.get_children():
-            child.dfs_defenses(defenses)
+            child.dfs_defenses(defenses, seen)
 
 
 class Subgoal(Node):
+    __slots__ = ("operation_type",)
+
     def __init__(
         self,
         name,
@@ -120,6 +149,13 @@ class Subgoal(Node):
 
 
 class Attack(Node):
+    __slots__ = (
+        "completion_time",
+        "success_probability",
+        "activation_cost",
+        "proportional_cost",
+    )
+
     def __init__(
         self,
         completion_time,
@@ -140,6 +176,8 @@ class Attack(Node):
 
 
 class Defense(Node):
+    __slots__ = ("period", "success_probability", "cost", "followers", "followed")
+
     def __init__(self, period, success_probability, cost, name, parents=None):
         super().__init__(
             parents=parents,
@@ -154,11 +192,12 @@ class Defense(Node):
 
 
 class ADG:
-    def __init__(self, root):
+    def __init__(self, root, checkpoint_cache_size=2**16):
         assert not root.defenses
         self.root = root
         self.root.set_parents()
         self.init_dfs()
+        self.init_checkpoints(checkpoint_cache_size)
         if self.follows_cyclic():
             print(
                 "Warning: defenses following is cyclic! This leads to nondeterminism."
@@ -183,20 +222,38 @@ class ADG:
                 self.subgoals.append(node)
         self.nodes = self.attacks + self.subgoals
 
+        # Bitmask encoding of the nodes used by the ADMDP states (the root is not in
+        # self.nodes but can be completed)
+        self.indexed_nodes = self.nodes + [self.root] + self.defenses
+        self.bits = {node.name: 1 << i for i, node in enumerate(self.indexed_nodes)}
+        for i, node in enumerate(self.indexed_nodes):
+            node.id = i
+        self.by_id = dict(enumerate(self.indexed_nodes))
+        self.by_name = {node.name: node for node in self.indexed_nodes}
+        self.defended_mask = self.mask(node for node in self.nodes if node.defenses)
+        self.init_propagation()
+
         self.defense_periods = []
         self.defense_proba = []
+        # d2 follows d1 if it defends a sibling of a node defended by d1 (see follows)
+        following = dict()
         for defense in self.defenses:
             self.defense_periods.append(defense.period)
             self.defense_proba.append(defense.success_probability)
-            defense.followers = [
+            defended = set(defense.parents)
+            following[defense] = {
                 defense2
-                for defense2 in self.defenses
-                if self.follows(defense, defense2)
+                for parent in defense.parents
+                for sibling in parent.get_children()
+                if sibling not in defended
+                for defense2 in sibling.defenses
+            }
+        for defense in self.defenses:
+            defense.followers = [
+                defense2 for defense2 in self.defenses if defense2 in following[defense]
             ]
             defense.followed = [
-                defense2
-                for defense2 in self.defenses
-                if self.follows(defense2, defense)
+                defense2 for defense2 in self.defenses if defense in following[defense2]
             ]
 
         self.attack_times = []
@@ -209,87 +266,176 @@ class ADG:
             self.attack_costs.append(attack.activation_cost)
             self.attack_costrates.append(attack.proportional_cost)
 
+    def bit(self, node):
+        return self.bits[node.name]
+
+    def mask(self, nodes):
+        """Bitmask of the given nodes."""
+        mask = 0
+        for node in nodes:
+            mask |= self.bits[node.name]
+        return mask
+
+    def unmask(self, mask):
+        """List of the nodes encoded in the bitmask, in index order."""
+        nodes = []
+        while mask:
+            low_bit = mask & -mask
+            nodes.append(self.indexed_nodes[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return nodes
+
     def update_defense_periods(self):
         self.defense_periods.clear()
         for defense in self.defenses:
             self.defense_periods.append(defense.period)
 
-    def propagate(self, activated, completed):
-        # Add parents node that are completed
-        fixed_point = False
-        while not fixed_point:
-            fixed_point = True
-            for node in completed.copy():
-                for parent in node.parents:
-                    if (
-                        parent is not None
-                        and parent not in completed
-                        and (
-                            parent.operation_type == OperationType.OR
-                            or (
-                                parent.operation_type == OperationType.AND
-                                and {n.name for n in parent.attack_childern}
-                                <= {n.name for n in completed}
-                                and {n.name for n in parent.subgoal_children}
-                                <= {n.name for n in completed}
-                            )
-                        )
-                    ):
-                        fixed_point = False
-                        completed.append(parent)
-
-    def has_checkpoint_ancestors(
-        self, subgoal, completed, include_checkpoint_itself=False
-    ):
-        if include_checkpoint_itself and subgoal in completed and not subgoal.defenses:
-            return True
-        elif not subgoal.parents:
-            return False
-        else:
-            return all(
-                [
-                    self.has_checkpoint_ancestors(
-                        parent, completed, include_checkpoint_itself=True
-                    )
-                    for parent in subgoal.parents
-                ]
+    def init_propagation(self):
+        """Should be used only at initialization to set self.propagation: the subgoals
+        in bottom-up order with their bit, their children mask and their operation."""
+        bottom_up = []
+        visited = set()
+
+        def visit(subgoal):
+            visited.add(subgoal.name)
+            for child in subgoal.subgoal_children:
+                if child.name not in visited:
+                    visit(child)
+            bottom_up.append(subgoal)
+
+        if self.root.node_type == NodeType.SUBGOAL:
+            visit(self.root)
+        self.propagation = [
+            (
+                self.bit(subgoal),
+                self.mask(subgoal.get_children()),
+                subgoal.operation_type,
             )
+            for subgoal in bottom_up
+        ]
 
-    def completed_subadg(self, completed):
-        return [
-            node
-            for node in self.nodes
-            if self.has_checkpoint_ancestors(node, completed)
+    def propagate(self, completed):
+        """Return the completed bitmask with the parents nodes that are completed. A
+        single bottom-up pass reaches the fixed point."""
+        for bit, children, operation_type in self.propagation:
+            if completed & bit or not completed & children:
+                continue
+            if operation_type == OperationType.OR or (completed & children) == children:
+                completed |= bit
+        return completed
+
+    def init_checkpoints(self, cache_size):
+        """Should be used only at initialization to set self.top_down: the nodes in
+        top-down order with their bit and the mask of their parents."""
+        bottom_up = []
+        visited = set()
+
+        def visit(node):
+            visited.add(node.name)
+            for child in node.get_children():
+                if child.name not in visited:
+                    visit(child)
+            bottom_up.append(node)
+
+        visit(self.root)
+        self.top_down = [
+            (self.bit(node), self.mask(node.parents)) for node in reversed(bottom_up)
         ]
+        self.undefended_mask = self.mask(
+            node for node in self.nodes + [self.root] if not node.defenses
+        )
+        self.nodes_mask = self.mask(self.nodes)
+        self.checkpoint_ancestors = functools.lru_cache(maxsize=cache_size)(
+            self.compute_checkpoint_ancestors
+        )
+
+    def compute_checkpoint_ancestors(self, completed):
+        """Bitmask of the nodes that have a checkpoint (completed node without
+        defense) in all paths leading to the root. Use the cached version
+        self.checkpoint_ancestors."""
+        covered = completed & self.undefended_mask
+        checkpoint_ancestors = 0
+        for bit, parents in self.top_down:
+            if parents and parents & covered == parents:
+                checkpoint_ancestors |= bit
+                covered |= bit
+        return checkpoint_ancestors
+
+    def satisfied_ancestors(self, completed):
+        """Bitmask of the nodes that have a completed node, defended or not, in all
+        paths leading to the root."""
+        covered = completed
+        satisfied_ancestors = 0
+        for bit, parents in self.top_down:
+            if parents and parents & covered == parents:
+                satisfied_ancestors |= bit
+                covered |= bit
+        return satisfied_ancestors
+
+    def checkpoint_cache_info(self):
+        """Hits and misses of the checkpoint ancestors cache."""
+        return self.checkpoint_ancestors.cache_info()
+
+    def completed_subadg(self, completed):
+        return self.checkpoint_ancestors(completed) & self.nodes_mask
 
     def reduce_activated_completed(self, activated, completed):
-        # Remove completed nodes that have a checkpoint in all paths leading to the main subgoal
-        old_completed = completed.copy()
-        for node in old_completed:
-            if self.has_checkpoint_ancestors(node, old_completed):
-                completed.remove(node)
-        # Remove activated nodes that have a checkpoint in all paths leading to the main subgoal
-        for node in activated.copy():
-            if self.has_checkpoint_ancestors(node, old_completed):
-                activated.remove(node)
-        # Remove activated nodes that are comleted
-        for node in activated.copy():
-            if node in completed:
-                activated.remove(node)
+        """Return the activated and completed bitmasks without the nodes that have a
+        checkpoint in all paths leading to the main subgoal and without the activated
+        nodes that are completed."""
+        checkpoint_ancestors = self.checkpoint_ancestors(completed)
+        completed &= ~checkpoint_ancestors
+        activated &= ~checkpoint_ancestors & ~completed
+        return activated, completed
+
+    def normalize(self, activated, completed):
+        """Canonical activated and completed bitmasks of a state."""
+        return self.reduce_activated_completed(activated, self.propagate(completed))
+
+    def node_signature(self, node):
+        """Part of a node the ADMDP structure depends on: its type, name, children and
+        defenses, and for attacks and defenses whether they are stochastic (success
+        probability lower than 1) and how their costs are modeled. Times, costs and
+        probabilities are only used by the declaration of the Uppaal model."""
+        signature = (
+            node.node_type.name,
+            node.name,
+            tuple(child.name for child in node.get_children()),
+            tuple(defense.name for defense in node.defenses),
+        )
+        if node.node_type == NodeType.SUBGOAL:
+            signature += (node.operation_type.name,)
+        elif node.node_type == NodeType.ATTACK:
+            signature += (
+                node.success_probability < 1,
+                bool(node.activation_cost),
+                node.proportional_cost is None,
+            )
+        else:
+            signature += (node.success_probability < 1,)
+        return signature
+
+    def structure_hash(self):
+        """Hash of the signatures of the nodes in index order (see node_signature)."""
+        digest = hashlib.sha256()
+        for node in self.indexed_nodes:
+            digest.update(repr(self.node_signature(node)).encode())
+        return digest.hexdigest()
 
     def follows(self, d1, d2):
         """Returns 'd2 follows d1' (i.e., d1 |> d2 using the triangle notation)."""
-
+        d1_parents = set(d1.parents)
+        d2_parents = set(d2.parents)
         for node1 in d1.parents:
             for node2 in node1.get_children():
-                if node2 not in d1.parents and node2 in d2.parents:
+                if node2 not in d1_parents and node2 in d2_parents:
                     return True
         return False
 
     def find_cycle(self, defense, visited):
         if defense in visited:
             return True
-        visited.append(defense)
+        visited.add(defense)
         return any(
             [self.find_cycle(follower, visited) for follower in defense.followers]
         )  # returns False if empty
@@ -297,7 +443,7 @@ class ADG:
     def follows_cyclic(self):
         defenses = self.defenses.copy()
         for defense in defenses:
-            visited = []
+            visited = set()
             if self.find_cycle(defense, visited):
                 return True
 
@@ -1,4 +1,6 @@
+from collections import deque
 from enum import Enum
+import time
 from adg import ADG, Subgoal, Attack, Defense, OperationType, NodeType
 
 
@@ -22,32 +24,296 @@ class EdgeType(Enum):
 
 
 def defense_activation_activated_completed(
-    defense, destination_activated, destination_completed
+    defense, destination_activated, destination_completed, adg
 ):
-    """Remove inplace the atomic attacks that are deactivated and the subgoals that are
-    reseted with a successful defense activation."""
-    for node in defense.parents:
-        if node in destination_completed:
-            destination_completed.remove(node)
-        if node in destination_activated:
-            destination_activated.remove(node)
+    """Return the activated and completed bitmasks without the atomic attacks that are
+    deactivated and the subgoals that are reseted with a successful defense
+    activation."""
+    reseted = adg.mask(defense.parents)
+    return destination_activated & ~reseted, destination_completed & ~reseted
 
 
 class ADMDP:
-    def __init__(self, adg):
+    def __init__(self, adg, order="dfs", progress=None, progress_interval=10000):
         self.adg = adg
         self.states = dict()
-        self.build_admdp()
+        # States built for this ADMDP, explored or not (see Unique)
+        self.interned = dict()
+        self.build_admdp(
+            order=order, progress=progress, progress_interval=progress_interval
+        )
 
-    def build_admdp(self):
-        """Build ADMDP from given ADG."""
+    def build_admdp(self, order="dfs", progress=None, progress_interval=10000):
+        """Build ADMDP from given ADG by exploring the reachable states with a
+        worklist. order is "dfs" (depth first, the successors of a state in the order
+        of its edges, which follow the bit order of the masks rather than the former
+        recursive exploration, so the states and the Uppaal XML are ordered
+        differently) or "bfs". progress is called every progress_interval explored
+        states with the number of explored states, the frontier size and the states
+        per second."""
+        assert order in ("dfs", "bfs")
         self.initial_state = AttackerState(
-            activated=[],
-            completed=[],
+            activated=0,
+            completed=0,
             adg=self.adg,
+            cache=self.interned,
             initial=True,
         )
-        self.initial_state.build(admdp=self)
+        cache_info = self.adg.checkpoint_cache_info()
+        self.explore(order, progress=progress, progress_interval=progress_interval)
+        # Checkpoint ancestors cache hits and misses during this build
+        self.checkpoint_cache_hits = (
+            self.adg.checkpoint_cache_info().hits - cache_info.hits
+        )
+        self.checkpoint_cache_misses = (
+            self.adg.checkpoint_cache_info().misses - cache_info.misses
+        )
+        # Merged states (see minimize) and pruned states (see prune) can't be updated
+        self.minimized = False
+        self.pruned = False
+        # Structure of the ADG the states were built from (see update)
+        self.signatures = {
+            node.name: self.adg.node_signature(node) for node in self.adg.indexed_nodes
+        }
+
+    def explore(self, order="dfs", progress=None, progress_interval=10000):
+        """Explore the states reachable from the initial state, building their
+        edges."""
+        self.states = dict()
+        self.accepting_state = None
+        frontier = deque([self.initial_state])
+        pop = frontier.pop if order == "dfs" else frontier.popleft
+        start = time.perf_counter()
+        while frontier:
+            state = pop()
+            if state.key in self.states:
+                continue
+            self.states[state.key] = state
+            if state.accepting:
+                self.accepting_state = state
+            state.build_edges(self)
+            successors = [
+                edge.destination
+                for edge in state.edges
+                if edge.destination.key not in self.states
+            ]
+            # Reversed so that the first successor is the next popped in dfs order
+            frontier.extend(reversed(successors) if order == "dfs" else successors)
+            if progress and len(self.states) % progress_interval == 0:
+                elapsed = time.perf_counter() - start
+                progress(
+                    len(self.states),
+                    len(frontier),
+                    len(self.states) / elapsed if elapsed > 0 else float("inf"),
+                )
+
+    def update(self, adg, order="dfs"):
+        """Update the ADMDP to adg, an ADG built after editing the nodes of the current
+        one. If the structure of the ADG is unchanged (same nodes in the same order
+        with the same signatures, see ADG.node_signature), only times, costs and
+        probabilities were edited: the states and their edges are kept and bound to
+        the nodes of adg. Otherwise the ADMDP is rebuilt from scratch, as it is if it
+        was minimized or pruned: the edges of the attacker states depend on all the
+        attacks they could activate, so a structural edit changes most of the states.
+        Return the number of rebuilt states."""
+        signatures = {node.name: adg.node_signature(node) for node in adg.indexed_nodes}
+        if (
+            self.minimized
+            or self.pruned
+            or list(signatures.items()) != list(self.signatures.items())
+        ):
+            self.clear()
+            self.adg = adg
+            self.build_admdp(order=order)
+            return len(self.states)
+        nodes = adg.by_name
+        for state in self.interned.values():
+            state.adg = adg
+            if state.node_slot:
+                setattr(state, state.node_slot, nodes[state.extra_node().name])
+            for edge in state.edges:
+                edge.rebind(nodes)
+        self.adg = adg
+        return 0
+
+    def minimize(self):
+        """Merge the bisimilar states by partition refinement. States are first
+        split by type, accepting, activated attacks and relevant defenses (see prune),
+        which give the clocks, invariants and cost rate of their Uppaal location, and
+        attack of the activation cost states, then by the multiset of their edges
+        (type, node and success) to the blocks of the destinations until the partition
+        is stable. The first state of each block
+        (the initial state for its block) is kept and the edges are redirected to the
+        kept states. Return the numbers of states and edges before and after."""
+        states = list(self.states.values())
+        edges_before = sum(len(state.edges) for state in states)
+        index = {state.key: i for i, state in enumerate(states)}
+        labels = [[edge_label(edge) for edge in state.edges] for state in states]
+        destinations = [
+            [index[edge.destination.key] for edge in state.edges] for state in states
+        ]
+        blocks = renumber(
+            (
+                state.state_type.value,
+                state.accepting,
+                state.activated,
+                state.relevant_defenses,
+                (
+                    state.attack.name
+                    if state.state_type == StateType.ACTIVATION_COST
+                    else ""
+                ),
+            )
+            for state in states
+        )
+        while True:
+            refined = renumber(
+                (
+                    blocks[i],
+                    tuple(sorted(zip(labels[i], [blocks[j] for j in destinations[i]]))),
+                )
+                for i in range(len(states))
+            )
+            if max(refined, default=0) == max(blocks, default=0):
+                break
+            blocks = refined
+
+        # Initial state first in the states order (see explore)
+        kept = dict()
+        for state, block in zip(states, blocks):
+            kept.setdefault(block, state)
+        self.states = {state.key: state for state in kept.values()}
+        for state in self.states.values():
+            for edge in state.edges:
+                edge.destination = kept[blocks[index[edge.destination.key]]]
+        if self.accepting_state is not None:
+            self.accepting_state = kept[blocks[index[self.accepting_state.key]]]
+        self.interned = dict(self.states)
+        self.minimized = True
+        return {
+            "states": (len(states), len(self.states)),
+            "edges": (
+                edges_before,
+                sum(len(state.edges) for state in self.states.values()),
+            ),
+        }
+
+    def prune(self, activations=False):
+        """Remove the edges that can't help the attacker and the states that are not
+        reachable anymore:
+        - the edges of the attacker states to the states that can't reach the goal,
+          when the attacker state can (the other edges are kept since the runs that
+          fail are still measured);
+        - the loop edges of the defenses whose clocks don't matter anymore: defenses
+          that are never active in the reachable states and are no followers of an
+          active one. Their clocks are left out of the invariants of the states
+          (relevant_defenses);
+        - if activations is True, the activations of the attacks that only lead to the
+          root through completed nodes. This removes the attacks started in advance in
+          case a defense resets a completed node, so the optimal attack may be slower.
+        Return the numbers of removed states and edges."""
+        adg = self.adg
+        removed_activations = 0
+        if activations:
+            for state in self.states.values():
+                if state.state_type != StateType.NORMAL:
+                    continue
+                satisfied = adg.satisfied_ancestors(state.completed)
+                edges = [
+                    edge
+                    for edge in state.edges
+                    if edge.type
+                    not in (EdgeType.ACTIVATION, EdgeType.TO_ACTIVATION_COST)
+                    or not satisfied & adg.bit(edge.attack)
+                ]
+                removed_activations += len(state.edges) - len(edges)
+                state.edges = edges
+
+        # States that can reach the goal
+        predecessors = dict()
+        for state in self.states.values():
+            for edge in state.edges:
+                predecessors.setdefault(edge.destination.key, []).append(state)
+        alive = set()
+        frontier = [self.accepting_state] if self.accepting_state else []
+        while frontier:
+            state = frontier.pop()
+            if state.key in alive:
+                continue
+            alive.add(state.key)
+            frontier.extend(predecessors.get(state.key, []))
+        removed_dead = 0
+        for state in self.states.values():
+            if state.state_type == StateType.NORMAL and state.key in alive:
+                edges = [edge for edge in state.edges if edge.destination.key in alive]
+                removed_dead += len(state.edges) - len(edges)
+                state.edges = edges
+
+        # Reachable states, in the exploration order
+        reachable = set()
+        frontier = [self.initial_state]
+        while frontier:
+            state = frontier.pop()
+            if state.key in reachable:
+                continue
+            reachable.add(state.key)
+            frontier.extend(edge.destination for edge in state.edges)
+        states_number = len(self.states)
+        self.states = {
+            key: state for key, state in self.states.items() if key in reachable
+        }
+
+        # Relevant defenses: active in a reachable state or follower of a relevant one
+        followers = {
+            adg.bit(defense): adg.mask(defense.followers) for defense in adg.defenses
+        }
+        predecessors = dict()
+        for state in self.states.values():
+            state.relevant_defenses = 0
+            for edge in state.edges:
+                predecessors.setdefault(edge.destination.key, []).append(state)
+                if edge.type == EdgeType.TO_DEFENSE:
+                    state.relevant_defenses |= adg.bit(edge.defense)
+        frontier = list(self.states.values())
+        while frontier:
+            state = frontier.pop()
+            relevant = state.relevant_defenses
+            for bit, mask in followers.items():
+                if relevant & bit:
+                    relevant |= mask
+            for edge in state.edges:
+                relevant |= edge.destination.relevant_defenses
+            if relevant != state.relevant_defenses:
+                state.relevant_defenses = relevant
+                frontier.append(state)
+                frontier.extend(predecessors.get(state.key, []))
+        removed_loops = 0
+        for state in self.states.values():
+            edges = [
+                edge
+                for edge in state.edges
+                if edge.type != EdgeType.LOOP_DEFENSE
+                or state.relevant_defenses & adg.bit(edge.defense)
+            ]
+            removed_loops += len(state.edges) - len(edges)
+            state.edges = edges
+
+        self.interned = dict(self.states)
+        self.pruned = True
+        return {
+            "states": states_number - len(self.states),
+            "activations": removed_activations,
+            "dead_edges": removed_dead,
+            "loops": removed_loops,
+        }
+
+    def clear(self):
+        """Release the states of this ADMDP and the caches of its ADG."""
+        self.states.clear()
+        self.interned.clear()
+        self.initial_state = None
+        self.accepting_state = None
+        self.adg.checkpoint_ancestors.cache_clear()
 
     def __str__(self):
         edges_number = 0
@@ -61,53 +327,105 @@ class ADMDP:
         return string
 
 
-class Unique(type):
-    """Make sure a state class has unique objects."""
+def edge_label(edge):
+    """What distinguishes an edge besides its source and destination."""
+    return (
+        edge.type.value,
+        edge.attack.name if hasattr(edge, "attack") else "",
+        edge.defense.name if hasattr(edge, "defense") else "",
+        getattr(edge, "success", True),
+    )
+
 
-    def __call__(cls, *args, **kwargs):
-        self = cls.__new__(cls, *args, **kwargs)
-        cls.__init__(self, *args, **kwargs)
-        if self.key not in cls._cache:
-            cls._cache[self.key] = self
-        return cls._cache[self.key]
+def renumber(signatures):
+    """Number the signatures by order of first appearance."""
+    numbers = dict()
+    return [numbers.setdefault(signature, len(numbers)) for signature in signatures]
 
-    def __init__(cls, name, bases, attributes):
-        super().__init__(name, bases, attributes)
-        cls._cache = {}
+
+class Unique(type):
+    """Make sure a state class has unique objects in the given cache (the states
+    interned by an ADMDP). The canonical key is computed from the normalized bitmasks
+    before building the state, so that duplicates are never built."""
+
+    def __call__(cls, activated, completed, adg, cache, **kwargs):
+        activated, completed = adg.normalize(activated, completed)
+        key = cls.make_key(activated, completed, adg, **kwargs)
+        if key not in cache:
+            self = cls.__new__(cls)
+            self.key = key
+            cls.__init__(
+                self, activated=activated, completed=completed, adg=adg, **kwargs
+            )
+            cache[key] = self
+        return cache[key]
 
 
 class State(metaclass=Unique):
-    """Super class for states."""
+    """Super class for states. The activated and completed sets of nodes are bitmasks
+    over the node indexes of the ADG (see ADG.bits), already normalized by
+    ADG.normalize when __init__ is called."""
+
+    __slots__ = (
+        "edges",
+        "activated",
+        "completed",
+        "initial",
+        "accepting",
+        "adg",
+        "_completed_subadg",
+        "_active_defenses",
+        "relevant_defenses",
+        "key",
+    )
+    state_type = None
+    # Slot of the node given to the constructor besides the bitmasks
+    node_slot = None
 
     def __init__(
         self,
         activated,
         completed,
         adg,
-        state_type=None,
         edges=None,
         initial=False,
         accepting=False,
     ):
         self.edges = edges if edges else []
-        self.activated = activated
-        self.completed = completed
         self.initial = initial
         self.accepting = accepting
-        adg.propagate(self.activated, self.completed)
-        adg.reduce_activated_completed(self.activated, self.completed)
+        self.activated = activated
+        self.completed = completed
         self.adg = adg
-        # Build subadgs of nodes that doesn't matter anymore
-        self.completed_subadg = self.adg.completed_subadg(self.completed)
-
-        # Build list of defenses that matter
-        self.active_defenses = []
-        for node in self.activated + self.completed:
-            for defense in node.defenses:
-                if defense not in self.active_defenses:
-                    self.active_defenses.append(defense)
-
-        self.state_type = state_type
+        self._completed_subadg = None
+        self._active_defenses = None
+        # Defenses whose clocks still matter, None for all (see ADMDP.prune)
+        self.relevant_defenses = None
+
+    @classmethod
+    def make_key(cls, activated, completed, adg, **kwargs):
+        """Hashable key of the state used for insuring unique states."""
+        # we remove the defense periods while it is unique in the admdp
+        return (activated, completed, cls.state_type.value)
+
+    def extra_node(self):
+        return getattr(self, self.node_slot) if self.node_slot else None
+
+    @property
+    def completed_subadg(self):
+        """Bitmask of the subadgs of nodes that doesn't matter anymore."""
+        if self._completed_subadg is None:
+            self._completed_subadg = self.adg.completed_subadg(self.completed)
+        return self._completed_subadg
+
+    @property
+    def active_defenses(self):
+        """Bitmask of the defenses that matter."""
+        if self._active_defenses is None:
+            self._active_defenses = 0
+            for node in self.adg.unmask(self.activated | self.completed):
+                self._active_defenses |= self.adg.mask(node.defenses)
+        return self._active_defenses
 
     def __str__(self):
         string = ""
@@ -116,142 +434,115 @@ class State(metaclass=Unique):
         return string
 
     def serialize(self):
-        """Hashable name of the state used for insuring unique states."""
+        """Names based version of the key, used to name the Uppaal locations."""
         return (
-            tuple(sorted({elem.name for elem in self.activated})),
-            tuple(sorted({elem.name for elem in self.completed})),
-            # we remove the defense periods while it is unique in the admdp
-            # tuple(sorted(self.adg.defense_periods)),
+            tuple(sorted(node.name for node in self.adg.unmask(self.activated))),
+            tuple(sorted(node.name for node in self.adg.unmask(self.completed))),
             self.state_type.name,
         )
 
-    def get_activated(self, copy=True):
-        if copy:
-            return self.activated.copy()
-        else:
-            return self.activated
-
-    def get_completed(self, copy=True):
-        if copy:
-            return self.completed.copy()
-        else:
-            return self.completed
-
 
 class AttackerState(State):
     """States (A,B) of atomic attacks activated and completed nodes."""
 
+    __slots__ = ()
+    state_type = StateType.NORMAL
+
     def __init__(self, activated, completed, adg, initial=False, accepting=False):
         super().__init__(
             activated=activated,
             completed=completed,
             adg=adg,
-            state_type=StateType.NORMAL,
             initial=initial,
             accepting=accepting,
         )
-        self.key = self.serialize()
-        if len(self.completed) > 0 and self.completed[0].name == adg.root.name:
+        if self.completed & adg.bit(adg.root):
             self.accepting = True
 
     def __str__(self):
         return f"Attacker State {self.serialize()}\n" + super().__str__()
 
-    def build(self, admdp):
-        if self.key not in admdp.states:
-            admdp.states[self.key] = self
-            self.build_edges(admdp)
-            if self.accepting:
-                admdp.accepting_state = self
-
     def build_edges(self, admdp):
         """Edges to activate other atomic attacks or to wait for completion or mtd
         activation."""
         # Activation edges
+        excluded = self.activated | self.completed | self.completed_subadg
         for attack in admdp.adg.attacks:
-            if (
-                attack not in self.activated
-                and attack not in self.completed
-                and attack not in self.completed_subadg
-            ):
+            if not excluded & self.adg.bit(attack):
                 if attack.activation_cost is None or attack.activation_cost == 0:
                     self.build_activation_edges(attack, admdp)
                 else:
                     self.build_activation_cost_edge(attack, admdp)
 
         # No activation edge
-        if len(self.activated) > 0 or any(
-            [len(node.defenses) > 0 for node in self.completed]
-        ):
+        if self.activated or self.completed & self.adg.defended_mask:
             self.build_no_activation_edge(admdp)
 
     def build_activation_edges(self, attack, admdp):
         destination = AttackerState(
-            activated=self.get_activated() + [attack],
-            completed=self.get_completed(),
+            activated=self.activated | self.adg.bit(attack),
+            completed=self.completed,
             adg=self.adg,
+            cache=admdp.interned,
         )
         self.edges.append(
             ActivationEdge(source=self, destination=destination, attack=attack)
         )
-        destination.build(admdp=admdp)
 
     def build_activation_cost_edge(self, attack, admdp):
         destination = ActivationCostState(
-            activated=self.get_activated(),
-            completed=self.get_completed(),
+            activated=self.activated,
+            completed=self.completed,
             attack=attack,
             adg=self.adg,
+            cache=admdp.interned,
         )
         self.edges.append(
             ActivationCostEdge(source=self, destination=destination, attack=attack)
         )
-        destination.build(admdp=admdp)
 
     def build_no_activation_edge(self, admdp):
         destination = NoActivationState(
-            activated=self.get_activated(),
-            completed=self.get_completed(),
+            activated=self.activated,
+            completed=self.completed,
             adg=self.adg,
+            cache=admdp.interned,
         )
         self.edges.append(NoActivationEdge(source=self, destination=destination))
-        destination.build(admdp=admdp)
 
 
 class CompletionState(State):
     """State when an atomic attack is stochasticly completed. It leads to a branchpoint
     in Uppaal."""
 
+    __slots__ = ("new_completed",)
+    state_type = StateType.COMPLETION
+    node_slot = "new_completed"
+
     def __init__(self, activated, completed, new_completed, adg, initial=False):
         super().__init__(
             activated=activated,
             completed=completed,
             adg=adg,
-            state_type=StateType.COMPLETION,
             initial=initial,
         )
         self.new_completed = new_completed
-        self.key = self.serialize()
+
+    @classmethod
+    def make_key(cls, activated, completed, adg, new_completed, **kwargs):
+        return super().make_key(activated, completed, adg) + (adg.bit(new_completed),)
 
     def __str__(self):
         return f"Completion State {self.serialize()}\n" + super().__str__()
 
-    def build(self, admdp):
-        if self.key not in admdp.states:
-            admdp.states[self.key] = self
-            self.build_edges(admdp)
-
     def build_edges(self, admdp):
         # Success edge
-        destination_success_activated = self.get_activated()
-        destination_success_activated.remove(self.new_completed)
-        destination_success_completed = self.get_completed()
-        destination_success_completed.append(self.new_completed)
-
+        new_completed = self.adg.bit(self.new_completed)
         destination_success = AttackerState(
-            activated=destination_success_activated,
-            completed=destination_success_completed,
+            activated=self.activated & ~new_completed,
+            completed=self.completed | new_completed,
             adg=self.adg,
+            cache=admdp.interned,
         )
 
         self.edges.append(
@@ -262,17 +553,13 @@ class CompletionState(State):
                 success=True,
             )
         )
-        destination_success.build(admdp=admdp)
 
         # Fail edge
-        destination_fail_activated = self.get_activated()
-        destination_fail_activated.remove(self.new_completed)
-        destination_fail_completed = self.get_completed()
-
         destination_fail = AttackerState(
-            activated=destination_fail_activated,
-            completed=destination_fail_completed,
+            activated=self.activated & ~new_completed,
+            completed=self.completed,
             adg=self.adg,
+            cache=admdp.interned,
         )
 
         self.edges.append(
@@ -283,7 +570,6 @@ class CompletionState(State):
                 success=False,
             )
         )
-        destination_fail.build(admdp=admdp)
 
     def serialize(self):
         return super().serialize() + (self.new_completed.name,)
@@ -293,37 +579,40 @@ class DefenseState(State):
     """State when a MTD defense is stochasticly activated. It leads to a branchpoint
     in Uppaal."""
 
+    __slots__ = ("defense",)
+    state_type = StateType.MTD
+    node_slot = "defense"
+
     def __init__(self, activated, completed, defense, adg, initial=False):
         super().__init__(
             activated=activated,
             completed=completed,
             adg=adg,
-            state_type=StateType.MTD,
             initial=initial,
         )
         self.defense = defense
-        self.key = self.serialize()
+
+    @classmethod
+    def make_key(cls, activated, completed, adg, defense, **kwargs):
+        return super().make_key(activated, completed, adg) + (adg.bit(defense),)
 
     def __str__(self):
         return f"Defense State {self.serialize()}\n" + super().__str__()
 
-    def build(self, admdp):
-        if self.key not in admdp.states:
-            admdp.states[self.key] = self
-            self.build_edges(admdp)
-
     def build_edges(self, admdp):
         # Success edge
-        destination_success_activated = self.get_activated()
-        destination_success_completed = self.get_completed()
-        defense_activation_activated_completed(
-            self.defense, destination_success_activated, destination_success_completed
+        (
+            destination_success_activated,
+            destination_success_completed,
+        ) = defense_activation_activated_completed(
+            self.defense, self.activated, self.completed, self.adg
         )
 
         destination_success = AttackerState(
             activated=destination_success_activated,
             completed=destination_success_completed,
             adg=self.adg,
+            cache=admdp.interned,
         )
 
         self.edges.append(
@@ -334,13 +623,13 @@ class DefenseState(State):
                 success=True,
             )
         )
-        destination_success.build(admdp=admdp)
 
         # Fail edge
         destination_fail = AttackerState(
-            activated=self.get_activated(),
-            completed=self.get_completed(),
+            activated=self.activated,
+            completed=self.completed,
             adg=self.adg,
+            cache=admdp.interned,
         )
 
         self.edges.append(
@@ -359,26 +648,22 @@ class DefenseState(State):
 class NoActivationState(State):
     """State when the defenser decides to wait and not activated more atomic attacks."""
 
+    __slots__ = ()
+    state_type = StateType.NO_ACTIVATION
+
     def __init__(self, activated, completed, adg, initial=False):
         super().__init__(
             activated=activated,
             completed=completed,
             adg=adg,
-            state_type=StateType.NO_ACTIVATION,
             initial=initial,
         )
-        self.key = self.serialize()
 
     def __str__(self):
         return f"No activation State {self.serialize()}\n" + super().__str__()
 
-    def build(self, admdp):
-        if self.key not in admdp.states:
-            admdp.states[self.key] = self
-            self.build_edges(admdp)
-
     def build_edges(self, admdp):
-        for attack in self.activated:
+        for attack in self.adg.unmask(self.activated):
             self.build_completion_edge(attack, admdp)
 
         for defense in self.adg.defenses:
@@ -388,51 +673,54 @@ class NoActivationState(State):
         """A completion edge for each atomic attacks in self.activated."""
         if attack.success_probability < 1:
             destination = CompletionState(
-                activated=self.get_activated(),
-                completed=self.get_completed(),
+                activated=self.activated,
+                completed=self.completed,
                 new_completed=attack,
                 adg=self.adg,
+                cache=admdp.interned,
             )
         else:
             destination = AttackerState(
-                activated=self.get_activated(),
-                completed=self.get_completed() + [attack],
+                activated=self.activated,
+                completed=self.completed | self.adg.bit(attack),
                 adg=self.adg,
+                cache=admdp.interned,
             )
         self.edges.append(
             ToCompletionEdge(source=self, destination=destination, attack=attack)
         )
-        destination.build(admdp=admdp)
 
     def build_defense_edge(self, defense, admdp):
         """For each defense, a looping edge to reset a clock if the
         defense is not active, and a MTD activation edge if the defense
         has an impact on the activated atomic attacks or the completed
         nodes."""
-        if defense in self.active_defenses:
+        if self.active_defenses & self.adg.bit(defense):
             if defense.success_probability < 1:
                 destination = DefenseState(
-                    activated=self.get_activated(),
-                    completed=self.get_completed(),
+                    activated=self.activated,
+                    completed=self.completed,
                     defense=defense,
                     adg=self.adg,
+                    cache=admdp.interned,
                 )
             else:
-                destination_activated = self.get_activated()
-                destination_completed = self.get_completed()
-                defense_activation_activated_completed(
-                    defense, destination_activated, destination_completed
+                (
+                    destination_activated,
+                    destination_completed,
+                ) = defense_activation_activated_completed(
+                    defense, self.activated, self.completed, self.adg
                 )
 
                 destination = AttackerState(
                     activated=destination_activated,
                     completed=destination_completed,
                     adg=self.adg,
+                    cache=admdp.interned,
                 )
             self.edges.append(
                 ToDefenseEdge(source=self, destination=destination, defense=defense)
             )
-            destination.build(admdp=admdp)
         else:
             self.edges.append(
                 LoopDefenseEdge(source=self, destination=self, defense=defense)
@@ -443,34 +731,38 @@ class ActivationCostState(State):
     """State where we stay one unit of time to increase the cost hybrid clock
     of a given cost activation value."""
 
+    __slots__ = ("attack",)
+    state_type = StateType.ACTIVATION_COST
+    node_slot = "attack"
+
     def __init__(self, activated, completed, attack, adg):
         super().__init__(
             activated=activated,
             completed=completed,
-            state_type=StateType.ACTIVATION_COST,
             adg=adg,
         )
         self.attack = attack
-        self.key = self.serialize()
+
+    @classmethod
+    def make_key(cls, activated, completed, adg, attack, **kwargs):
+        return super().make_key(activated, completed, adg) + (adg.bit(attack),)
 
     def __str__(self):
         return f"Activation cost state {self.serialize()}\n" + super().__str__()
 
-    def build(self, admdp):
-        if self.key not in admdp.states:
-            admdp.states[self.key] = self
-            self.build_activation_edge(self.attack, admdp)
+    def build_edges(self, admdp):
+        self.build_activation_edge(self.attack, admdp)
 
     def build_activation_edge(self, attack, admdp):
         destination = AttackerState(
-            activated=self.get_activated() + [attack],
-            completed=self.get_completed(),
+            activated=self.activated | self.adg.bit(attack),
+            completed=self.completed,
             adg=self.adg,
+            cache=admdp.interned,
         )
         self.edges.append(
             ActivationEdge(source=self, destination=destination, attack=attack)
         )
-        destination.build(admdp=admdp)
 
     def serialize(self):
         return super().serialize() + (self.attack.name,)
@@ -479,13 +771,30 @@ class ActivationCostState(State):
 class Edge:
     """Edge super class."""
 
+    __slots__ = ("source", "destination", "type")
+
     def __init__(self, source, destination):
         assert source is not None and destination is not None
         self.source = source
         self.destination = destination
 
+    def rebind(self, nodes):
+        """Use the nodes (dictionary by name) of an updated ADG."""
+        for slot in ("attack", "defense"):
+            if hasattr(self, slot):
+                node = nodes[getattr(self, slot).name]
+                setattr(self, slot, node)
+        if hasattr(self, "success_probability"):
+            self.success_probability = (
+                node.success_probability
+                if self.success
+                else 1.0 - node.success_probability
+            )
+
 
 class ActivationEdge(Edge):
+    __slots__ = ("attack",)
+
     def __init__(self, source, destination, attack):
         super().__init__(source=source, destination=destination)
         self.attack = attack
@@ -493,6 +802,8 @@ class ActivationEdge(Edge):
 
 
 class ToCompletionEdge(Edge):
+    __slots__ = ("attack",)
+
     def __init__(self, source, destination, attack):
         super().__init__(source=source, destination=destination)
         self.attack = attack
@@ -500,6 +811,8 @@ class ToCompletionEdge(Edge):
 
 
 class CompletionEdge(Edge):
+    __slots__ = ("attack", "success", "success_probability")
+
     def __init__(self, source, destination, attack, success):
         super().__init__(source=source, destination=destination)
         self.attack = attack
@@ -512,6 +825,8 @@ class CompletionEdge(Edge):
 
 
 class ToDefenseEdge(Edge):
+    __slots__ = ("defense",)
+
     def __init__(self, source, destination, defense):
         super().__init__(source=source, destination=destination)
         self.defense = defense
@@ -519,6 +834,8 @@ class ToDefenseEdge(Edge):
 
 
 class DefenseEdge(Edge):
+    __slots__ = ("defense", "success", "success_probability")
+
     def __init__(self, source, destination, defense, success):
         super().__init__(source=source, destination=destination)
         self.defense = defense
@@ -531,6 +848,8 @@ class DefenseEdge(Edge):
 
 
 class LoopDefenseEdge(Edge):
+    __slots__ = ("defense",)
+
     def __init__(self, source, destination, defense):
         super().__init__(source=source, destination=destination)
         self.defense = defense
@@ -538,12 +857,16 @@ class LoopDefenseEdge(Edge):
 
 
 class NoActivationEdge(Edge):
+    __slots__ = ()
+
     def __init__(self, source, destination):
         super().__init__(source=source, destination=destination)
         self.type = EdgeType.NO_ACTIVATION
 
 
 class ActivationCostEdge(Edge):
+    __slots__ = ("attack",)
+
     def __init__(self, source, destination, attack):
         super().__init__(source=source, destination=destination)
         self.attack = attack
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+
+from compiled import CompiledADMDP
+
+
+class ResultCache:
+    """Persistent cache on disk of verification results. Each entry is a file named by
+    the hash of its key (see make_key) holding the result and some metadata. The least
+    recently used entries are evicted when the cache is larger than max_size bytes."""
+
+    def __init__(self, directory, max_size=2**30):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # The cache can be shared by the threads of Optimizer.verify_many
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self.paths())
+
+    @staticmethod
+    def make_key(*parts):
+        """Content address of the given strings."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def paths(self):
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".pickle")
+        ]
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def get(self, key):
+        """Cached result of the key, None if it is not in the cache."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as entry_file:
+                entry = pickle.load(entry_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Most recently used
+        except OSError:
+            pass  # Evicted by another thread since it was read
+        with self.lock:
+            self.hits += 1
+        return entry["result"]
+
+    def put(self, key, result, metadata=None):
+        path = self.path(key)
+        with self.lock:
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "wb") as entry_file:
+                pickle.dump({"result": result, "metadata": metadata}, entry_file)
+            os.replace(temporary_path, path)
+            self.size += os.path.getsize(path)
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size.
+        Should be called with the lock."""
+        if self.size <= self.max_size:
+            return
+        for path in sorted(self.paths(), key=os.path.getmtime):
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.size -= size
+            if self.size <= self.max_size:
+                break
+
+    def entries(self):
+        """Key, metadata and result of all the entries, without counting hits or
+        marking the entries as used."""
+        for path in self.paths():
+            try:
+                with open(path, "rb") as entry_file:
+                    entry = pickle.load(entry_file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            key = os.path.basename(path)[: -len(".pickle")]
+            yield key, entry["metadata"], entry["result"]
+
+    def report(self):
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests if requests else 0
+        return (
+            f"cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), "
+            f"{len(self.paths())} entries, {self.size} bytes"
+        )
+
+
+class ModelCache:
+    """Persistent cache on disk of the models built from an ADG, in a subdirectory per
+    ADG.structure_hash: the CompiledADMDP tables (compiled/), and the template of the
+    Uppaal model (template.xml) with the location name of the goal (goal.txt). The
+    models of minimized or pruned ADMDPs (see ADMDP.minimize and ADMDP.prune) are kept
+    apart."""
+
+    def __init__(self, directory, minimized=False, pruned=False):
+        self.directory = directory
+        self.minimized = minimized
+        self.pruned = pruned
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, adg):
+        return os.path.join(
+            self.directory,
+            f"{adg.structure_hash()}-v{CompiledADMDP.format_version}"
+            + ("-pruned" if self.pruned else "")
+            + ("-minimized" if self.minimized else ""),
+        )
+
+    def load_compiled(self, adg):
+        """Cached CompiledADMDP of the ADG with its times, costs and probabilities,
+        None if it is not in the cache."""
+        try:
+            compiled = CompiledADMDP.load(os.path.join(self.path(adg), "compiled"))
+        except (OSError, ValueError):
+            return None
+        compiled.refresh(adg)
+        return compiled
+
+    def save_compiled(self, adg, compiled):
+        path = self.path(adg)
+        # Saved aside then renamed, so that a partial entry is never loaded
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        compiled.save(os.path.join(temporary_path, "compiled"))
+        os.makedirs(path, exist_ok=True)
+        try:
+            os.rename(
+                os.path.join(temporary_path, "compiled"), os.path.join(path, "compiled")
+            )
+        except OSError:
+            shutil.rmtree(os.path.join(temporary_path, "compiled"))
+        os.rmdir(temporary_path)
+
+    def template(self, adg):
+        """Path of the cached template of the ADG and location name of its goal, None
+        if they are not in the cache."""
+        path = self.path(adg)
+        template = os.path.join(path, "template.xml")
+        goal = os.path.join(path, "goal.txt")
+        if os.path.exists(template) and os.path.exists(goal):
+            with open(goal) as goal_file:
+                return template, goal_file.read()
+        return None
+
+    def save_template(self, adg, exporter):
+        path = self.path(adg)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "goal.txt"), "w") as goal_file:
+            goal_file.write(exporter.goal_name)
+        # The template is written last, the entry is complete once it exists
+        template = os.path.join(path, "template.xml")
+        exporter.save_template(f"{template}.tmp")
+        os.replace(f"{template}.tmp", template)
@@ -0,0 +1,223 @@
+import json
+import os
+
+import numpy as np
+
+from admdp import StateType, EdgeType
+
+
+class CompiledADMDP:
+    """Integer tables of an ADMDP for vectorized algorithms. The states are numbered in
+    the order of ADMDP.states and the edges of state s are the edges
+    edge_offsets[s]:edge_offsets[s + 1] (compressed sparse rows). Attacks and defenses
+    are numbered in the order of adg.attacks and adg.defenses, -1 meaning none.
+    The tables can be saved to a directory of .npy files, loaded memory-mapped.
+    The structure of the tables only depends on ADG.structure_hash, the times, costs
+    and probabilities are set from the ADG by refresh."""
+
+    format_version = 2
+    # Saved tables, the others are computed by init_derived
+    arrays = (
+        "state_type",
+        "accepting",
+        "activated",
+        "state_attack",
+        "edge_offsets",
+        "edge_destination",
+        "edge_type",
+        "edge_attack",
+        "edge_defense",
+        "edge_success",
+        "edge_probability",
+        "completion_time",
+        "activation_cost",
+        "proportional_cost",
+        "period",
+        "followers",
+    )
+
+    def __init__(self, admdp):
+        adg = admdp.adg
+        states = list(admdp.states.values())
+        index = {state.key: i for i, state in enumerate(states)}
+        attack_index = {attack.name: i for i, attack in enumerate(adg.attacks)}
+        defense_index = {defense.name: i for i, defense in enumerate(adg.defenses)}
+        self.states_number = len(states)
+        self.initial = index[admdp.initial_state.key]
+
+        # States
+        self.state_type = np.array([state.state_type.value for state in states])
+        self.accepting = np.array([state.accepting for state in states], dtype=bool)
+        # The attacks are the first bits of the masks (see ADG.indexed_nodes)
+        self.activated = np.array(
+            [
+                [(state.activated >> i) & 1 for i in range(len(adg.attacks))]
+                for state in states
+            ],
+            dtype=bool,
+        ).reshape(len(states), len(adg.attacks))
+        self.state_attack = np.array(
+            [
+                (
+                    attack_index[state.attack.name]
+                    if state.state_type == StateType.ACTIVATION_COST
+                    else -1
+                )
+                for state in states
+            ]
+        )
+
+        # Edges
+        edges = [edge for state in states for edge in state.edges]
+        self.edge_offsets = np.cumsum([0] + [len(state.edges) for state in states])
+        self.edge_destination = np.array(
+            [index[edge.destination.key] for edge in edges], dtype=np.int64
+        )
+        self.edge_type = np.array([edge.type.value for edge in edges], dtype=np.int64)
+        self.edge_attack = np.array(
+            [
+                attack_index[edge.attack.name] if hasattr(edge, "attack") else -1
+                for edge in edges
+            ],
+            dtype=np.int64,
+        )
+        self.edge_defense = np.array(
+            [
+                defense_index[edge.defense.name] if hasattr(edge, "defense") else -1
+                for edge in edges
+            ],
+            dtype=np.int64,
+        )
+        # Success or fail edge of a branchpoint
+        self.edge_success = np.array(
+            [getattr(edge, "success", True) for edge in edges], dtype=bool
+        )
+        self.refresh(adg)
+
+    def refresh(self, adg):
+        """Set the times, costs and probabilities from the ADG, which must have the
+        same structure."""
+        self.completion_time = np.array(
+            [attack.completion_time for attack in adg.attacks], dtype=float
+        )
+        self.activation_cost = np.array(
+            [attack.activation_cost or 0 for attack in adg.attacks], dtype=float
+        )
+        self.proportional_cost = np.array(
+            [attack.proportional_cost or 0 for attack in adg.attacks], dtype=float
+        )
+        self.attack_names = [attack.name for attack in adg.attacks]
+        self.defense_names = [defense.name for defense in adg.defenses]
+        self.period = np.array(
+            [defense.period for defense in adg.defenses], dtype=float
+        )
+        # followers[d, f] tells if f is a follower of d
+        self.followers = np.array(
+            [
+                [follower in defense.followers for follower in adg.defenses]
+                for defense in adg.defenses
+            ],
+            dtype=bool,
+        ).reshape(len(adg.defenses), len(adg.defenses))
+        success_probability = np.array(
+            [attack.success_probability for attack in adg.attacks]
+            + [defense.success_probability for defense in adg.defenses]
+            + [1.0]
+        )
+        # Index of the success probability of the edges in success_probability
+        node = np.where(
+            self.edge_type == EdgeType.COMPLETION.value,
+            self.edge_attack,
+            np.where(
+                self.edge_type == EdgeType.DEFENSE.value,
+                len(adg.attacks) + self.edge_defense,
+                -1,
+            ),
+        )
+        self.edge_probability = np.where(
+            self.edge_success,
+            success_probability[node],
+            1.0 - success_probability[node],
+        )
+        self.init_derived()
+
+    def init_derived(self):
+        """Tables computed from the others."""
+        self.cost_rate = self.activated.astype(float) @ self.proportional_cost
+        degree = np.diff(self.edge_offsets)
+        self.edge_source = np.repeat(np.arange(self.states_number), degree)
+        # Edges of each state padded with -1
+        self.state_edges = np.full(
+            (self.states_number, max(degree.max(initial=0), 1)), -1, dtype=np.int64
+        )
+        columns = np.arange(self.state_edges.shape[1])
+        present = columns < degree[:, None]
+        self.state_edges[present] = np.arange(self.edge_offsets[-1])
+        # Defenses with an edge from each state, whose clocks matter (see ADMDP.prune)
+        self.state_defenses = np.zeros(
+            (self.states_number, len(self.period)), dtype=bool
+        )
+        defended = self.edge_defense >= 0
+        sources = self.edge_source[defended]
+        self.state_defenses[sources, self.edge_defense[defended]] = True
+
+    @property
+    def edges_number(self):
+        return len(self.edge_destination)
+
+    def periods(self, times=None):
+        """Defense periods, overridden by times (dictionary with the names of the
+        defenses as key)."""
+        if not times:
+            return self.period
+        return np.array(
+            [
+                times.get(name, period)
+                for name, period in zip(self.defense_names, self.period)
+            ],
+            dtype=float,
+        )
+
+    def save(self, directory):
+        """Save the tables as .npy files and the other attributes as meta.json in the
+        directory."""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.arrays:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+            json.dump(
+                {
+                    "format_version": self.format_version,
+                    "states_number": self.states_number,
+                    "initial": self.initial,
+                    "attack_names": self.attack_names,
+                    "defense_names": self.defense_names,
+                },
+                meta_file,
+            )
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load tables saved by save, memory-mapped (read only) if mmap is True."""
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        if meta["format_version"] != cls.format_version:
+            raise ValueError(
+                f"Compiled ADMDP format {meta['format_version']} is not supported"
+            )
+        compiled = cls.__new__(cls)
+        for name in cls.arrays:
+            setattr(
+                compiled,
+                name,
+                np.load(
+                    os.path.join(directory, f"{name}.npy"),
+                    mmap_mode="r" if mmap else None,
+                ),
+            )
+        compiled.states_number = meta["states_number"]
+        compiled.initial = meta["initial"]
+        compiled.attack_names = meta["attack_names"]
+        compiled.defense_names = meta["defense_names"]
+        compiled.init_derived()
+        return compiled
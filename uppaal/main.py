@@ -256,14 +256,18 @@ def print_results(
     csv=False,
     output=None,
     simulation_number=10000,
+    result=None,
 ):
-    adg = optimizer.admdp.adg
-    result = optimizer.verify(
-        model_name,
-        simulation_number=simulation_number,
-        time_limit=time_limit,
-        cost_limit=cost_limit,
-    )
+    adg = optimizer.adg
+    if result is None:
+        result = optimizer.verify(
+            model_name,
+            simulation_number=simulation_number,
+            time_limit=time_limit,
+            cost_limit=cost_limit,
+        )
+    elif isinstance(result, subprocess.TimeoutExpired):
+        raise result
     if csv:
         (
             E_time,
@@ -402,9 +406,50 @@ def explore_limits(optimizer, csv, model_name, output):
         )
 
 
-def list_limits(optimizer, csv, model_name, output, time_limits, cost_limits):
+def limit_results(optimizer, model_name, limits, workers=1, batch=False, batch_size=8):
+    """Results of the limits (pairs of time limit and cost limit) in order, None if
+    print_results has to verify the limit. The parallel jobs are submitted in order
+    and the pending ones are cancelled when the generator is closed, and the batches
+    are verified one at a time, so that the limits after a stop are not verified."""
+    if batch:
+        # Verify batch_size limits with each verifyta run
+        for start in range(0, len(limits), batch_size):
+            yield from optimizer.verify_limits(
+                model_name, limits[start : start + batch_size]
+            )
+    elif workers > 1:
+        yield from optimizer.iter_verify(
+            [
+                {"time_limit": time_limit, "cost_limit": cost_limit}
+                for time_limit, cost_limit in limits
+            ],
+            workers=workers,
+        )
+    else:
+        yield from [None] * len(limits)
+
+
+def list_limits(
+    optimizer,
+    csv,
+    model_name,
+    output,
+    time_limits,
+    cost_limits,
+    workers=1,
+    batch=False,
+    batch_size=8,
+):
     timeout_series = 0
-    for time_limit in time_limits:
+    results = limit_results(
+        optimizer,
+        model_name,
+        [(time_limit, None) for time_limit in time_limits],
+        workers=workers,
+        batch=batch,
+        batch_size=batch_size,
+    )
+    for time_limit, result in zip(time_limits, results):
         print(f"time limit {time_limit}")
         try:
             E_time, E_cost, P_success_sup = print_results(
@@ -414,6 +459,7 @@ def list_limits(optimizer, csv, model_name, output, time_limits, cost_limits):
                 model_name=model_name,
                 csv=csv,
                 output=output,
+                result=result,
             )
         except subprocess.TimeoutExpired:
             timeout_series += 1
@@ -426,8 +472,18 @@ def list_limits(optimizer, csv, model_name, output, time_limits, cost_limits):
             timeout_series = 0
         if E_cost is None:
             break
+    # The limits after the stop are not verified
+    results.close()
     timeout_series = 0
-    for cost_limit in cost_limits:
+    results = limit_results(
+        optimizer,
+        model_name,
+        [(None, cost_limit) for cost_limit in cost_limits],
+        workers=workers,
+        batch=batch,
+        batch_size=batch_size,
+    )
+    for cost_limit, result in zip(cost_limits, results):
         print(f"cost_limit {cost_limit}")
         try:
             E_time, E_cost, P_success_sup = print_results(
@@ -437,6 +493,7 @@ def list_limits(optimizer, csv, model_name, output, time_limits, cost_limits):
                 model_name=model_name,
                 csv=csv,
                 output=output,
+                result=result,
             )
         except subprocess.TimeoutExpired:
             timeout_series += 1
@@ -449,6 +506,7 @@ def list_limits(optimizer, csv, model_name, output, time_limits, cost_limits):
             timeout_series = 0
         if E_time is None:
             break
+    results.close()
 
 
 ############
@@ -458,6 +516,13 @@ def list_limits(optimizer, csv, model_name, output, time_limits, cost_limits):
 if __name__ == "__main__":
     csv = False
     explore = False
+    workers = 1
+    batch = False  # Verify the limits of a defense configuration 8 at a time
+    cache_dir = None  # Persistent cache of the verifyta results
+    model_cache_dir = None  # Persistent cache of the ADMDP and the Uppaal template
+    prune_model = False  # Remove the useless edges and states before the export
+    minimize_model = False  # Merge the bisimilar states before the export
+    pareto = False  # Search the Pareto set of the periods instead of the grid below
     nickname = sys.argv[1] if len(sys.argv) > 1 else ""
     if csv:
         dirname = f"experiment-{time.strftime('%Y-%m-%d_%H-%M-%S')}{nickname}"
@@ -468,18 +533,44 @@ if __name__ == "__main__":
     print(
         f"""csv = {csv}
 explore = {explore}
+workers = {workers}
+batch = {batch}
+cache_dir = {cache_dir}
+model_cache_dir = {model_cache_dir}
+prune_model = {prune_model}
+minimize_model = {minimize_model}
+pareto = {pareto}
 output = {output}
 model_name = {model_name}
 """
     )
-    sys.setrecursionlimit(10 ** 6)
-
     adg = build_adg()
 
-    optimizer = Optimizer(adg)
+    optimizer = Optimizer(
+        adg,
+        cache_dir=cache_dir,
+        model_cache_dir=model_cache_dir,
+        prune_model=prune_model,
+        minimize_model=minimize_model,
+    )
     optimizer.export(model_name, simulation_number=10000, cost_limit=400)
-    admdp = optimizer.admdp.__str__()
-    print(admdp.split('\n')[0] + "\n")
+    compiled = optimizer.compiled
+    print(
+        f"number of states: {compiled.states_number}, "
+        f"number of edges: {compiled.edges_number}\n"
+    )
+    if optimizer.pruning:
+        pruning = optimizer.pruning
+        print(
+            f"pruning: {pruning['states']} states, {pruning['dead_edges']} edges to "
+            f"dead states and {pruning['loops']} defense loops removed\n"
+        )
+    if optimizer.minimization:
+        states, minimized_states = optimizer.minimization["states"]
+        print(
+            f"minimization: {states} -> {minimized_states} states "
+            f"({1 - minimized_states / states:.1%} reduction)\n"
+        )
 
     if csv:
         defense_names = [defense.name for defense in adg.defenses]
@@ -509,7 +600,7 @@ model_name = {model_name}
         # {"d_dsr": 100000, "d_dk": 100000, "d_cp": 100000, "d_cc": 160},
     ]:
         optimizer.set_defense_times(new_defenses)
-        print(f"Defense periods: {optimizer.admdp.adg.defense_periods}")
+        print(f"Defense periods: {optimizer.adg.defense_periods}")
         if explore:
             explore_limits(optimizer, csv=csv, model_name=model_name, output=output)
         else:
@@ -520,36 +611,59 @@ model_name = {model_name}
                 output=output,
                 time_limits=time_limits,
                 cost_limits=cost_limits,
+                workers=workers,
+                batch=batch,
             )
 
-    for t_dsr in range(3):
-        for t_dk in range(4):
-            for t_cc in range(4):
-                for t_cp in range(4):
-                    if t_dsr + t_dk + t_cc + t_cp != 8:
-                        continue
-                    if t_dsr > 0 and t_dk > 0 and t_cc > 0 and t_cp > 0:
-                        continue
-
-                    new_defenses = {
-                        "d_dsr": 230 * 3 ** t_dsr,
-                        "d_dk": 5 * 3 ** t_dk,
-                        "d_cc": 20 * 3 ** t_cc,
-                        "d_cp": 100 * 3 ** t_cp,
-                    }
-
-                    optimizer.set_defense_times(new_defenses)
-                    print(f"Defense periods: {optimizer.admdp.adg.defense_periods}")
-                    if explore:
-                        explore_limits(
-                            optimizer, csv=csv, model_name=model_name, output=output
-                        )
-                    else:
-                        list_limits(
-                            optimizer,
-                            csv=csv,
-                            model_name=model_name,
-                            output=output,
-                            time_limits=time_limits,
-                            cost_limits=cost_limits,
-                        )
+    if pareto:
+        # Defender's Pareto set (see Optimizer.pareto_search), each defense costing
+        # the same at each period
+        front = optimizer.pareto_search(
+            {defense.name: 1.0 for defense in adg.defenses},
+            cost_limit=400,
+            period_bounds=(5, 10000),
+            workers=workers,
+        )
+        print(f"{front.nfev} evaluations, Pareto set ({optimizer.period_names()}):")
+        for periods, (E_time, defense_cost, E_cost) in zip(front.x, front.F):
+            print(
+                f"{periods.tolist()}: E_time = {E_time:.2f}, "
+                f"defense cost = {defense_cost:.4f}, E_cost = {E_cost:.2f}"
+            )
+    else:
+        for t_dsr in range(3):
+            for t_dk in range(4):
+                for t_cc in range(4):
+                    for t_cp in range(4):
+                        if t_dsr + t_dk + t_cc + t_cp != 8:
+                            continue
+                        if t_dsr > 0 and t_dk > 0 and t_cc > 0 and t_cp > 0:
+                            continue
+
+                        new_defenses = {
+                            "d_dsr": 230 * 3 ** t_dsr,
+                            "d_dk": 5 * 3 ** t_dk,
+                            "d_cc": 20 * 3 ** t_cc,
+                            "d_cp": 100 * 3 ** t_cp,
+                        }
+
+                        optimizer.set_defense_times(new_defenses)
+                        print(f"Defense periods: {optimizer.adg.defense_periods}")
+                        if explore:
+                            explore_limits(
+                                optimizer, csv=csv, model_name=model_name, output=output
+                            )
+                        else:
+                            list_limits(
+                                optimizer,
+                                csv=csv,
+                                model_name=model_name,
+                                output=output,
+                                time_limits=time_limits,
+                                cost_limits=cost_limits,
+                                workers=workers,
+                                batch=batch,
+                            )
+
+    if optimizer.cache:
+        print(optimizer.cache.report())
@@ -1,84 +1,275 @@
-from scipy.optimize import LinearConstraint, Bounds, minimize
+from concurrent.futures import ThreadPoolExecutor
+from scipy.optimize import NonlinearConstraint, Bounds, OptimizeResult, minimize
+import math
 import numpy as np
+import os
 import subprocess
 import re
+import threading
 
 from admdp import ADMDP
+from cache import ResultCache, ModelCache
+from compiled import CompiledADMDP
+from simulator import Simulator, BatchSimulator
+from surrogate import GaussianProcess, expected_improvement
+from pareto import (
+    nondominated_sort,
+    crowding_distance,
+    simulated_binary_crossover,
+    polynomial_mutation,
+)
 from adg import ADG, Subgoal, Attack, Defense, OperationType
 from uppaal import UppaalExporter
 
+# Numbers printed by verifyta, only the unsigned mantissa (first group) is used
+NUMBER = re.compile(r"[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?")
+ERASE_LINE = re.compile(r"\x1b\[2?K")
+# Result of a strategy that is not found
+NOT_FOUND = (None, None, (None, None, None), (None, None, None), (None, None, None))
+
+
+def numbers(line):
+    return [match[0] for match in NUMBER.findall(line)]
+
+
+def formula_outputs(lines):
+    """Lines of the output of each formula of verifyta -s (the options of the
+    verification first), yielded as soon as the blank line ending it is read."""
+    output = []
+    for line in lines:
+        line = ERASE_LINE.sub("", line).rstrip("\n")
+        if line:
+            output.append(line)
+        elif output:
+            yield output
+            output = []
+    if output:
+        yield output
+
+
+def strategy_found(output):
+    return any("Formula is satisfied." in line for line in output)
+
+
+def strategy_not_found(output):
+    return any("Formula is NOT satisfied." in line for line in output)
+
+
+def expectation(output):
+    """Value and distribution (low, up, histogram) of an E[...](max: ...) formula,
+    None if its output is truncated."""
+    if len(output) < 4:
+        return None
+    value, distribution = numbers(output[2]), numbers(output[3])
+    if len(value) < 2 or len(distribution) < 4:
+        return None
+    return float(value[1]), (
+        float(distribution[0]),
+        float(distribution[1]),
+        [int(count) for count in distribution[4:]],
+    )
+
+
+def probability(output):
+    """Bounds and confidence of a Pr[...] formula, None if its output is truncated."""
+    if len(output) < 4:
+        return None
+    bounds, confidence = numbers(output[2]), numbers(output[3])
+    if len(bounds) < 3 or not confidence:
+        return None
+    return float(bounds[1]), float(bounds[2]), float(confidence[0])
+
+
+def strategy_results(outputs):
+    """Results of the strategies from the outputs of their formulas (see
+    UppaalExporter.make_queries and formula_outputs): expected time, expected cost,
+    success probability (low, up, confidence) and time and cost distributions, or
+    NOT_FOUND. A result is yielded as soon as its formulas are read, without waiting
+    for the formulas under a strategy that is not found. The parsing stops at the
+    first truncated output (verifyta killed or ended early)."""
+    outputs = iter(outputs)
+    for output in outputs:
+        if not strategy_found(output):
+            if not strategy_not_found(output):
+                return
+            yield NOT_FOUND
+            for _ in range(3):
+                next(outputs, None)
+            continue
+        formulas = [next(outputs, None) for _ in range(3)]
+        if None in formulas:
+            return
+        # E[...](max: time), E[...](max: cost) and Pr[...] under the strategy
+        time_expectation = expectation(formulas[0])
+        cost_expectation = expectation(formulas[1])
+        success = probability(formulas[2])
+        if None in (time_expectation, cost_expectation, success):
+            return
+        E_time, time_distribution = time_expectation
+        E_cost, cost_distribution = cost_expectation
+        yield (
+            E_time,
+            E_cost,
+            success,
+            time_distribution,
+            cost_distribution,
+        )
+
 
 def extract_formulas(formulas, offset=False):
+    """Result of the first strategy (the second one if offset) from the output of
+    verifyta split on blank lines. Raise ValueError if the output is truncated."""
+    outputs = [formula.split("\n") for formula in formulas[1:] if formula]
     if offset:
-        formulas = formulas[4:]
-    # Formula 9: strategy limited_cost = minE(time)[cost<=cost_limit]: <>AttackDefenseADMDP.goal
-    strategy_found = "Formula is satisfied." in formulas[1]
-    if not strategy_found:
-        return None, None, (None, None, None), (None, None, None), (None, None, None)
-    # Formula 10: E[cost<={cost_limit};{simulation_number}](max: time) under limited_cost
-    E_time = float(
-        re.findall(
-            "[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
-            formulas[2].split("\n")[2],
-        )[1][0]
-    )
-    time_distribution_matches = re.findall(
-        "[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?", formulas[2].split("\n")[3]
-    )
-    time_distribution_low = float(time_distribution_matches[0][0])
-    time_distribution_up = float(time_distribution_matches[1][0])
-    time_distribution_hist = [int(m[0]) for m in time_distribution_matches[4:]]
-    # Formula 11: E[cost<={cost_limit};{simulation_number}](max: cost) under limited_cost
-    E_cost = float(
-        re.findall(
-            "[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
-            formulas[3].split("\n")[2],
-        )[1][0]
-    )
-    cost_distribution_matches = re.findall(
-        "[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?", formulas[3].split("\n")[3]
-    )
-    cost_distribution_low = float(cost_distribution_matches[0][0])
-    cost_distribution_up = float(cost_distribution_matches[1][0])
-    cost_distribution_hist = [int(m[0]) for m in cost_distribution_matches[4:]]
-    # Formula 11: Pr[cost<={cost_limit}](<>AttackDefenseADMDP.goal) under limited_cost
-    P_success_inf = float(
-        re.findall(
-            "[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
-            formulas[4].split("\n")[2],
-        )[1][0]
-    )
-    P_success_sup = float(
-        re.findall(
-            "[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
-            formulas[4].split("\n")[2],
-        )[2][0]
-    )
-    P_success_confidence = float(
-        re.findall(
-            "[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
-            formulas[4].split("\n")[3],
-        )[0][0]
-    )
-    return (
-        E_time,
-        E_cost,
-        (P_success_inf, P_success_sup, P_success_confidence),
-        (time_distribution_low, time_distribution_up, time_distribution_hist),
-        (cost_distribution_low, cost_distribution_up, cost_distribution_hist),
-    )
+        outputs = outputs[4:]
+    result = next(strategy_results(outputs), None)
+    if result is None:
+        raise ValueError("verifyta output is truncated")
+    return result
 
 
 def score(E_time, E_cost, P_success_inf, P_success_sup):
     return E_time / 100 - E_cost / 400 + (P_success_inf + P_success_sup) / 2
 
 
+def score_result(result):
+    """Score of the result of a strategy, infinity if it is not found or timed out."""
+    if isinstance(result, Exception) or result[0] is None:
+        return math.inf
+    E_time, E_cost, (P_success_inf, P_success_sup, _), _, _ = result
+    return score(E_time, E_cost, P_success_inf, P_success_sup)
+
+
+def defense_cost(periods, proportions):
+    """Cost per unit of time of the defenses (of each row of periods), each defense
+    costing its proportion every period. The defense cost budget of the optimizers
+    is an upper bound of this cost."""
+    return np.sum(np.asarray(proportions) / np.asarray(periods), axis=-1)
+
+
+def periods_of(points, period_bounds, proportions=None, defense_cost_limit=None):
+    """Distinct integer periods of the points of [0, 1] ** defenses, on a logarithmic
+    scale between the period bounds, with a defense cost (see defense_cost) of at
+    most defense_cost_limit if given."""
+    low, up = np.log(period_bounds)
+    periods = np.clip(np.rint(np.exp(low + points * (up - low))), *period_bounds)
+    if defense_cost_limit is not None:
+        periods = periods[
+            defense_cost(periods, proportions) <= defense_cost_limit * (1 + 1e-9)
+        ]
+    return np.unique(periods, axis=0)
+
+
+def points_of(periods, period_bounds):
+    """Points of [0, 1] ** defenses of the periods (see periods_of)."""
+    low, up = np.log(period_bounds)
+    return (np.log(periods) - low) / max(up - low, 1e-12)
+
+
 class Optimizer:
-    verifyta_prefix = "/home/gabriel/uppaal64-4.1.20-stratego-7/bin-Linux/"
+    """Evaluate the ADG defense periods either with verifyta on the exported Uppaal
+    model (backend "verifyta") or with the built-in Monte Carlo simulator of the ADMDP
+    under the policy (backend "simulator", see simulator.Simulator, or its vectorized
+    version "batch", see simulator.BatchSimulator)."""
 
-    def __init__(self, adg):
+    verifyta_prefix = os.environ.get(
+        "VERIFYTA_PREFIX", "/home/gabriel/uppaal64-4.1.20-stratego-7/bin-Linux/"
+    )
+
+    def __init__(
+        self,
+        adg,
+        cache_dir=None,
+        cache_size=2**30,
+        backend="verifyta",
+        policy=None,
+        seed=None,
+        model_cache_dir=None,
+        minimize_model=False,
+        prune_model=False,
+    ):
+        if backend not in ("verifyta", "simulator", "batch"):
+            raise ValueError(f"Unknown backend {backend}")
+        # Attacker policy: a function of the state, its edges and the random
+        # generator for the backend "simulator", weights of the edges of the
+        # CompiledADMDP for the backend "batch"
+        if policy is not None:
+            if backend == "verifyta":
+                raise ValueError("The verifyta backend has no attacker policy")
+            if backend == "simulator" and not callable(policy):
+                raise TypeError(
+                    "The policy of the simulator backend is a function of the state, "
+                    "its edges and the random generator"
+                )
+            if backend == "batch":
+                if callable(policy):
+                    raise TypeError(
+                        "The policy of the batch backend is an array of edge weights"
+                    )
+                policy = np.asarray(policy, dtype=float)
+                if policy.ndim != 1:
+                    raise ValueError("The policy of the batch backend is 1-dimensional")
         self.adg = adg
-        self.admdp = ADMDP(self.adg)
+        self.backend = backend
+        self.policy = policy
+        self.seed = seed
+        self.exporter = None
+        # Persistent cache of the verification results
+        self.cache = ResultCache(cache_dir, cache_size) if cache_dir else None
+        # Persistent cache of the compiled ADMDP and the template of the ADG structure
+        self.model_cache = (
+            ModelCache(model_cache_dir, minimized=minimize_model, pruned=prune_model)
+            if model_cache_dir
+            else None
+        )
+        # Prune the ADMDP (see ADMDP.prune) then merge its bisimilar states (see
+        # ADMDP.minimize)
+        self.prune_model = prune_model
+        self.pruning = None
+        self.minimize_model = minimize_model
+        self.minimization = None
+        self.version = None
+        # Built when needed (see the properties)
+        self._admdp = None
+        self._compiled = None
+        self._simulator = None
+
+    @property
+    def admdp(self):
+        if self._admdp is None:
+            self._admdp = ADMDP(self.adg)
+            if self.prune_model:
+                self.pruning = self._admdp.prune()
+            if self.minimize_model:
+                self.minimization = self._admdp.minimize()
+        return self._admdp
+
+    @property
+    def compiled(self):
+        """CompiledADMDP of the ADG, loaded from the model cache if possible."""
+        if self._compiled is None and self.model_cache is not None:
+            self._compiled = self.model_cache.load_compiled(self.adg)
+        if self._compiled is None:
+            self._compiled = CompiledADMDP(self.admdp)
+            if self.model_cache is not None:
+                self.model_cache.save_compiled(self.adg, self._compiled)
+        return self._compiled
+
+    @property
+    def simulator(self):
+        if self._simulator is None:
+            if self.backend == "batch":
+                self._simulator = BatchSimulator(
+                    self._admdp,
+                    policy=self.policy,
+                    seed=self.seed,
+                    compiled=self.compiled,
+                )
+            else:
+                self._simulator = Simulator(
+                    self.admdp, policy=self.policy, seed=self.seed
+                )
+        return self._simulator
 
     def set_defense_times(self, times):
         """times is a dictionary with names of the defenses as key."""
@@ -86,7 +277,30 @@ class Optimizer:
             if defense.name in times:
                 defense.period = times[defense.name]
         self.adg.update_defense_periods()
-        self.exporter.set_defense_times(times)
+        if self._compiled is not None:
+            self._compiled.refresh(self.adg)
+        if self.exporter is not None:
+            self.exporter.set_defense_times(times)
+
+    def period_names(self):
+        """Names of the defenses in the order of the period vectors of minimize."""
+        return sorted(d.name for d in self.adg.defenses)
+
+    def defense_proportions(self, defense_cost_proportions):
+        """Costs of the defenses (dictionary by name) in the order of period_names."""
+        return np.array(
+            [defense_cost_proportions.get(name, 0.0) for name in self.period_names()]
+        )
+
+    def defense_cost_constraint(self, defense_cost_limit, defense_cost_proportions):
+        """Constraint of the period vectors: defense cost (see defense_cost) of at
+        most defense_cost_limit."""
+        proportions = self.defense_proportions(defense_cost_proportions)
+        return NonlinearConstraint(
+            lambda periods: defense_cost(periods, proportions),
+            -np.inf,
+            defense_cost_limit,
+        )
 
     def minimize(
         self,
@@ -94,65 +308,722 @@ class Optimizer:
         defense_cost_proportions,
         time_limit=None,
         cost_limit=None,
+        method="trust-constr",
+        **options,
     ):
-        defenses = self.adg.defenses
-        n_d = len(defenses)
-        coeficients_defenses = np.array(
-            [[c[1] for c in sorted(list(defense_cost_proportions.items()))]]
-        )
-        constraint_matrix = np.concatenate(
-            [np.eye(n_d), coeficients_defenses], dtype=float
-        )
-        left_bound = np.ones(n_d + 1)
-        left_bound[-1] = defense_cost_limit
-        right_bound = np.full(n_d + 1, np.inf)
-        right_bound[-1] = np.inf
-        linear_constraint = LinearConstraint(constraint_matrix, left_bound, right_bound)
+        """Defense periods of at least 1 minimizing the score (see evaluate) under the
+        defense cost constraint (see defense_cost_constraint), with scipy's
+        trust-constr or with
+        bayesian_minimize (method "bayesian", options being its keyword arguments)."""
+        if method == "bayesian":
+            return self.bayesian_minimize(
+                defense_cost_limit,
+                defense_cost_proportions,
+                time_limit=time_limit,
+                cost_limit=cost_limit,
+                **options,
+            )
         result = minimize(
             lambda td: self.evaluate(td, time_limit=time_limit, cost_limit=cost_limit),
-            np.ones(n_d),
-            method="trust-constr",
+            np.ones(len(self.adg.defenses)),
+            method=method,
+            bounds=Bounds(1, np.inf),
+            constraints=[
+                self.defense_cost_constraint(
+                    defense_cost_limit, defense_cost_proportions
+                )
+            ],
+            **options,
         )
         print(result.x)
         return result
 
+    def bayesian_minimize(
+        self,
+        defense_cost_limit,
+        defense_cost_proportions,
+        time_limit=None,
+        cost_limit=None,
+        simulation_number=10000,
+        evaluations=50,
+        batch_size=4,
+        workers=None,
+        period_bounds=(1, 10000),
+        initial_evaluations=None,
+        candidates_number=2000,
+        seed=None,
+        timeout=60 * 60 / 2,
+    ):
+        """Integer defense periods within period_bounds minimizing the score (see
+        evaluate) under the defense cost constraint, by Bayesian optimization: a
+        Gaussian process of the score over the logarithms of the periods chooses the
+        candidates of best expected improvement, batch_size at a time (the batch being
+        evaluated concurrently, see verify_many), for evaluations evaluations. The
+        cached evaluations of the model with the same queries are reused (see
+        cached_results), initial_evaluations (2 * defenses + 1 by default) random
+        periods completing them. The strategies that are not found or time out score
+        infinity. Return a scipy OptimizeResult with the periods (in the order of
+        period_names) x and their score fun, and all the evaluated periods X and their
+        scores y."""
+        if time_limit is not None and cost_limit is not None:
+            raise ValueError("The score is of a single strategy, give one limit")
+        names = self.period_names()
+        proportions = self.defense_proportions(defense_cost_proportions)
+        rng = np.random.default_rng(seed)
+        X, y = [], []
+        for periods, result in self.cached_results(
+            names, period_bounds, simulation_number, time_limit, cost_limit
+        ):
+            X.append(np.array(periods, dtype=float))
+            y.append(score_result(result))
+        evaluated = {tuple(periods) for periods in X}
+
+        def candidates_of(points):
+            """New feasible periods of the points."""
+            periods = periods_of(points, period_bounds, proportions, defense_cost_limit)
+            return np.array([p for p in periods if tuple(p) not in evaluated]).reshape(
+                -1, len(names)
+            )
+
+        def evaluate(periods):
+            results = self.verify_periods(
+                names,
+                periods,
+                simulation_number=simulation_number,
+                time_limit=time_limit,
+                cost_limit=cost_limit,
+                workers=workers,
+                timeout=timeout,
+            )
+            for p, result in zip(periods, results):
+                evaluated.add(tuple(p))
+                X.append(p)
+                y.append(score_result(result))
+
+        if initial_evaluations is None:
+            initial_evaluations = 2 * len(names) + 1
+        initial = candidates_of(rng.random((candidates_number, len(names))))
+        if len(initial) == 0 and not X:
+            raise ValueError("No periods within period_bounds meet the defense cost")
+        initial = initial[rng.permutation(len(initial))]
+        initial = initial[: min(max(initial_evaluations - len(X), 0), evaluations)]
+        evaluate(initial)
+        evaluations_number = len(initial)
+        gaussian_process = GaussianProcess(seed=seed)
+        iterations = 0
+        while evaluations_number < evaluations:
+            iterations += 1
+            scores = np.array(y)
+            finite = np.isfinite(scores)
+            # The infinite scores are given the worst finite score
+            worst = scores[finite].max() if finite.any() else 0.0
+            scores = np.where(finite, scores, worst)
+            points = points_of(np.array(X), period_bounds)
+            gaussian_process.fit(points, scores)
+            # Random candidates and perturbations of the best evaluations
+            best = points[np.argsort(scores)[:5]]
+            candidates = np.concatenate(
+                [
+                    rng.random((candidates_number, len(names))),
+                    np.clip(
+                        best[rng.integers(len(best), size=candidates_number)]
+                        + rng.normal(0, 0.05, (candidates_number, len(names))),
+                        0,
+                        1,
+                    ),
+                ]
+            )
+            candidates = candidates_of(candidates)
+            if len(candidates) == 0:
+                break
+            # Batch of the kriging believer: each chosen candidate is assumed to score
+            # its predicted mean for the choice of the next ones
+            batch, batch_points, batch_scores = [], points, scores
+            for _ in range(min(batch_size, evaluations - evaluations_number)):
+                if len(candidates) == 0:
+                    break
+                candidate_points = points_of(candidates, period_bounds)
+                mean, std = gaussian_process.predict(candidate_points)
+                i = expected_improvement(mean, std, scores.min()).argmax()
+                batch.append(candidates[i])
+                batch_points = np.vstack([batch_points, candidate_points[i]])
+                batch_scores = np.append(batch_scores, mean[i])
+                gaussian_process.fit(batch_points, batch_scores, optimize=False)
+                candidates = np.delete(candidates, i, axis=0)
+            evaluate(batch)
+            evaluations_number += len(batch)
+        if not X:
+            raise ValueError("No evaluation")
+        i = int(np.argmin(y))
+        return OptimizeResult(
+            x=X[i].astype(int),
+            fun=y[i],
+            success=bool(np.isfinite(y[i])),
+            nfev=evaluations_number,
+            nit=iterations,
+            X=np.array(X, dtype=int),
+            y=np.array(y),
+        )
+
+    def pareto_search(
+        self,
+        defense_cost_proportions,
+        time_limit=None,
+        cost_limit=None,
+        simulation_number=10000,
+        population_size=20,
+        generations=10,
+        workers=None,
+        period_bounds=(1, 10000),
+        defense_cost_limit=None,
+        min_success_probability=0.0,
+        seed=None,
+        timeout=60 * 60 / 2,
+    ):
+        """Pareto set of the integer defense periods within period_bounds for the
+        defender, maximizing the expected time and the expected cost of the attacker
+        and minimizing the defense cost (see defense_cost), by NSGA-II: each
+        generation of population_size periods breeds as many new periods (evaluated
+        concurrently, see verify_many) and the best ones of both, by Pareto front then
+        crowding distance, make the next generation. The cached evaluations of the
+        model with the same queries are reused (see cached_results), and the defense
+        cost is at most defense_cost_limit if given. The periods whose strategy is not found, times out or succeeds with a
+        mean probability below min_success_probability are left out. Return a scipy
+        OptimizeResult with the Pareto set x (periods in the order of period_names) and
+        its objectives F (expected time, defense cost and expected cost rows), and all
+        the evaluated periods X and their objectives objectives."""
+        if time_limit is not None and cost_limit is not None:
+            raise ValueError("The objectives are of a single strategy, give one limit")
+        names = self.period_names()
+        proportions = self.defense_proportions(defense_cost_proportions)
+        rng = np.random.default_rng(seed)
+        # Valid evaluations and their objectives (minimized)
+        X, objectives = [], []
+        evaluated = set()
+
+        def add(periods, result):
+            evaluated.add(tuple(periods))
+            if isinstance(result, Exception) or result[0] is None:
+                return
+            E_time, E_cost, (P_success_inf, P_success_sup, _), _, _ = result
+            if (P_success_inf + P_success_sup) / 2 < min_success_probability:
+                return
+            X.append(np.array(periods, dtype=float))
+            objectives.append(
+                (-E_time, float(defense_cost(periods, proportions)), -E_cost)
+            )
+
+        def evaluate(periods):
+            results = self.verify_periods(
+                names,
+                periods,
+                simulation_number=simulation_number,
+                time_limit=time_limit,
+                cost_limit=cost_limit,
+                workers=workers,
+                timeout=timeout,
+            )
+            for p, result in zip(periods, results):
+                add(p, result)
+            return len(periods)
+
+        def select(indices, size):
+            """Best indices of X by Pareto front then crowding distance."""
+            fronts = nondominated_sort(np.array(objectives)[indices])
+            selected = []
+            for front in fronts:
+                front = np.asarray(indices)[front]
+                if len(selected) + len(front) > size:
+                    distance = crowding_distance(np.array(objectives)[front])
+                    front = front[np.argsort(-distance, kind="stable")]
+                    front = front[: size - len(selected)]
+                selected.extend(front.tolist())
+                if len(selected) == size:
+                    break
+            return selected
+
+        def new_periods(points, size):
+            """At most size new feasible periods of the points."""
+            periods = [
+                p
+                for p in periods_of(
+                    points, period_bounds, proportions, defense_cost_limit
+                )
+                if tuple(p) not in evaluated
+            ]
+            return [periods[i] for i in rng.permutation(len(periods))[:size]]
+
+        for periods, result in self.cached_results(
+            names, period_bounds, simulation_number, time_limit, cost_limit
+        ):
+            if (
+                defense_cost_limit is None
+                or defense_cost(periods, proportions) <= defense_cost_limit
+            ):
+                add(periods, result)
+        evaluations_number = 0
+        if len(X) < population_size:
+            initial = new_periods(
+                rng.random((20 * population_size, len(names))),
+                population_size - len(X),
+            )
+            if not initial and not X:
+                raise ValueError(
+                    "No periods within period_bounds meet the defense cost"
+                )
+            evaluations_number += evaluate(initial)
+        population = select(range(len(X)), population_size) if X else []
+        for _ in range(generations):
+            if population:
+                fronts = nondominated_sort(np.array(objectives)[population])
+                rank = np.empty(len(population), dtype=int)
+                distance = np.empty(len(population))
+                for i, front in enumerate(fronts):
+                    rank[front] = i
+                    distance[front] = crowding_distance(
+                        np.array(objectives)[population][front]
+                    )
+
+                def tournament():
+                    i, j = rng.integers(len(population), size=2)
+                    better = (rank[i], -distance[i]) <= (rank[j], -distance[j])
+                    return points_of(X[population[i if better else j]], period_bounds)
+
+                children = []
+                for _ in range(10 * population_size):
+                    first, second = tournament(), tournament()
+                    if rng.random() < 0.9:
+                        first, second = simulated_binary_crossover(first, second, rng)
+                    children += [
+                        polynomial_mutation(first, rng),
+                        polynomial_mutation(second, rng),
+                    ]
+                offspring = new_periods(np.array(children), population_size)
+            else:
+                offspring = new_periods(
+                    rng.random((20 * population_size, len(names))), population_size
+                )
+            if not offspring:
+                break
+            evaluations_number += evaluate(offspring)
+            population = select(range(len(X)), population_size) if X else []
+        if not X:
+            raise ValueError("No valid evaluation")
+        front = nondominated_sort(objectives)[0]
+        front = front[np.argsort(np.array(objectives)[front, 0])[::-1]]
+        signs = np.array([-1, 1, -1])
+        return OptimizeResult(
+            x=np.array(X, dtype=int)[front],
+            F=np.array(objectives)[front] * signs,
+            nfev=evaluations_number,
+            X=np.array(X, dtype=int),
+            objectives=np.array(objectives) * signs,
+        )
+
+    def verify_periods(
+        self,
+        names,
+        periods,
+        simulation_number=10000,
+        time_limit=None,
+        cost_limit=None,
+        workers=None,
+        timeout=60 * 60 / 2,
+    ):
+        """Results of the period vectors (in the order of names), see verify_many."""
+        return self.verify_many(
+            [
+                {
+                    "times": dict(zip(names, map(int, p))),
+                    "simulation_number": simulation_number,
+                    "time_limit": time_limit,
+                    "cost_limit": cost_limit,
+                }
+                for p in periods
+            ],
+            workers=workers,
+            timeout=timeout,
+        )
+
+    def cached_results(
+        self, names, period_bounds, simulation_number, time_limit, cost_limit
+    ):
+        """Periods (in the order of names) within period_bounds and results of the
+        cached verifications of the model with the given queries. The key of each
+        entry is checked against the current declaration since the template digest of
+        their metadata doesn't cover the parameters of the attacks, and the entries
+        are read without counting them as cache hits (see ResultCache.entries)."""
+        if self.cache is None or self.backend != "verifyta":
+            return []
+        if self.exporter is None:
+            raise ValueError("The model must be exported (see export) first")
+        template = self.exporter.template_digest()
+        queries_xml = self.exporter.render_queries(
+            simulation_number, time_limit=time_limit, cost_limit=cost_limit
+        )
+        results = []
+        for key, metadata, result in self.cache.entries():
+            if (
+                not metadata
+                or metadata.get("template") != template
+                or metadata.get("simulation_number") != simulation_number
+                or metadata.get("time_limit") != time_limit
+                or metadata.get("cost_limit") != cost_limit
+                or not set(names) <= metadata["times"].keys()
+            ):
+                continue
+            times = metadata["times"]
+            periods = tuple(times[name] for name in names)
+            if not all(period_bounds[0] <= p <= period_bounds[1] for p in periods):
+                continue
+            declaration_xml = self.exporter.render_declaration(times)
+            if key == self.cache_key(declaration_xml, queries_xml):
+                results.append((periods, result))
+        return results
+
     def export(
         self, file_name, simulation_number=10000, time_limit=1000, cost_limit=400
     ):
         self.file_name = file_name
-        self.exporter = UppaalExporter(self.admdp, file_name)
-        self.exporter.make_xml(simulation_number, time_limit, cost_limit)
+        cached = self.model_cache.template(self.adg) if self.model_cache else None
+        if cached:
+            template, goal_name = cached
+            self.exporter = UppaalExporter(
+                None, file_name, adg=self.adg, goal_name=goal_name
+            )
+            self.exporter.make_xml(
+                simulation_number, time_limit, cost_limit, template=template
+            )
+        else:
+            self.exporter = UppaalExporter(self.admdp, file_name)
+            self.exporter.make_xml(simulation_number, time_limit, cost_limit)
+            if self.model_cache is not None:
+                self.model_cache.save_template(self.adg, self.exporter)
 
     def verify(
-        self, file_name, simulation_number=10000, time_limit=None, cost_limit=None
+        self,
+        file_name,
+        simulation_number=10000,
+        time_limit=None,
+        cost_limit=None,
+        timeout=60 * 60 / 2,
+        widths=None,
     ):
+        """widths are the target widths of the confidence intervals of the simulator
+        backends (see simulator.Simulator.estimate)."""
+        if self.backend != "verifyta":
+            return self.simulator.estimate(
+                simulation_number,
+                time_limit=time_limit,
+                cost_limit=cost_limit,
+                widths=widths,
+            )
         self.exporter.set_queries(
             simulation_number, time_limit=time_limit, cost_limit=cost_limit
         )
-        command = f"{self.verifyta_prefix}verifyta -s {file_name}"
-        process = subprocess.run(
-            command.split(), capture_output=True, encoding="utf-8", timeout=60 * 60 / 2
+        return self.cached(
+            lambda: self.run_verifyta(file_name, time_limit, cost_limit, timeout),
+            self.exporter.declaration_xml,
+            self.exporter.queries_xml,
+            metadata={
+                "times": {d.name: d.period for d in self.adg.defenses},
+                "simulation_number": simulation_number,
+                "time_limit": time_limit,
+                "cost_limit": cost_limit,
+            },
         )
-        output = process.stdout
-        output = output.replace("\x1b[2K", "")
-        output = output.replace("\x1b[K", "")
-        output = output.replace("\n\n\n", "\n\n")
-        formulas = output.split("\n\n")
-        if time_limit is not None and cost_limit is not None:
-            return extract_formulas(formulas), extract_formulas(formulas, offset=True)
+
+    def verifyta_version(self):
+        if self.version is None:
+            try:
+                self.version = subprocess.run(
+                    [f"{self.verifyta_prefix}verifyta", "--version"],
+                    capture_output=True,
+                    encoding="utf-8",
+                ).stdout
+            except OSError:
+                self.version = self.verifyta_prefix
+        return self.version
+
+    def cache_key(self, declaration_xml, queries_xml):
+        return ResultCache.make_key(
+            declaration_xml,
+            self.exporter.template_digest(),
+            queries_xml,
+            self.verifyta_version(),
+        )
+
+    def cached(self, run, declaration_xml, queries_xml, metadata=None):
+        """Result of run(), looked up in the cache by the content of the model and the
+        version of verifyta."""
+        if self.cache is None:
+            return run()
+        key = self.cache_key(declaration_xml, queries_xml)
+        result = self.cache.get(key)
+        if result is None:
+            result = run()
+            self.cache.put(
+                key,
+                result,
+                metadata=dict(metadata, template=self.exporter.template_digest()),
+            )
+        return result
+
+    def run_verifyta(
+        self, file_name, time_limit=None, cost_limit=None, timeout=60 * 60 / 2
+    ):
+        """Result of the strategy of the model, or of its two strategies if both
+        limits are given. verifyta is killed as soon as the last strategy is known: if
+        it is not found, the simulations under it are not waited for."""
+        strategies_number = (
+            2 if time_limit is not None and cost_limit is not None else 1
+        )
+        results = []
+        self.read_strategies(file_name, strategies_number, results, timeout)
+        if strategies_number == 2:
+            return results[0], results[1]
         else:
-            return extract_formulas(formulas)
+            return results[0]
+
+    def read_strategies(
+        self, file_name, strategies_number, results, timeout=60 * 60 / 2
+    ):
+        """Append the results of the first strategies_number strategies of the model
+        to results as they are read (so that it holds the known ones if verifyta times
+        out), verifyta being killed once they are known."""
+        known = len(results) + strategies_number
+        stream = self.stream_verifyta(file_name, timeout)
+        try:
+            for result in stream:
+                results.append(result)
+                if len(results) == known:
+                    break
+        finally:
+            stream.close()
+        if len(results) < known:
+            raise ValueError(f"verifyta output of {file_name} is incomplete")
+
+    def stream_verifyta(self, file_name, timeout=60 * 60 / 2):
+        """Run verifyta on the model and yield the result of each strategy (see
+        strategy_results) as soon as it is printed. verifyta is killed if the
+        generator is closed before the end. Raise subprocess.TimeoutExpired when
+        verifyta runs longer than timeout seconds, no result being yielded once it is
+        killed."""
+        command = [f"{self.verifyta_prefix}verifyta", "-s", file_name]
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            outputs = formula_outputs(process.stdout)
+            next(outputs, None)  # Options of the verification
+            for result in strategy_results(outputs):
+                # The output read after the kill may be truncated
+                if timed_out.is_set():
+                    break
+                yield result
+            process.wait()
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(command, timeout)
+        finally:
+            timer.cancel()
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+    def verify_limits(
+        self, file_name, limits, simulation_number=10000, timeout=60 * 60 / 2
+    ):
+        """Results of verify for each limit (pair of time limit and cost limit). The
+        queries of the limits that are not cached are written in a single queries
+        element (see UppaalExporter.render_batch_queries) of a copy of the model and
+        verified by a single verifyta run, so that verifyta starts and parses the model
+        only once. The results are cached per limit as if verified one by one. If the
+        run times out, the limits whose strategies are not all known get the
+        subprocess.TimeoutExpired exception instead of their result, and the results
+        of the others are not cached. timeout is per limit: the run is given timeout
+        times the number of limits it verifies."""
+        if self.backend != "verifyta":
+            return [
+                self.verify(
+                    file_name,
+                    simulation_number,
+                    time_limit=time_limit,
+                    cost_limit=cost_limit,
+                )
+                for time_limit, cost_limit in limits
+            ]
+        declaration_xml = self.exporter.declaration_xml
+        keys = [None] * len(limits)
+        results = [None] * len(limits)
+        if self.cache is not None:
+            for i, (time_limit, cost_limit) in enumerate(limits):
+                keys[i] = self.cache_key(
+                    declaration_xml,
+                    self.exporter.render_queries(
+                        simulation_number, time_limit=time_limit, cost_limit=cost_limit
+                    ),
+                )
+                results[i] = self.cache.get(keys[i])
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        # Number of strategies of each limit (see UppaalExporter.make_queries)
+        strategies_numbers = [
+            2 if limits[i][0] is not None and limits[i][1] is not None else 1
+            for i in missing
+        ]
+        base_name, extension = os.path.splitext(file_name)
+        batch_file_name = f"{base_name}-batch{extension}"
+        self.exporter.write_model(
+            queries_xml=self.exporter.render_batch_queries(
+                [limits[i] for i in missing], simulation_number
+            ),
+            output_file_name=batch_file_name,
+        )
+        strategies = []
+        timeout_expired = None
+        try:
+            self.read_strategies(
+                batch_file_name,
+                sum(strategies_numbers),
+                strategies,
+                timeout * len(missing),
+            )
+        except subprocess.TimeoutExpired as exception:
+            timeout_expired = exception
+        finally:
+            os.remove(batch_file_name)
+
+        times = {d.name: d.period for d in self.adg.defenses}
+        end = 0
+        for i, strategies_number in zip(missing, strategies_numbers):
+            end += strategies_number
+            if end > len(strategies):
+                results[i] = timeout_expired
+                continue
+            result = strategies[end - strategies_number : end]
+            results[i] = tuple(result) if strategies_number == 2 else result[0]
+            # Nothing of a killed run is cached
+            if self.cache is not None and timeout_expired is None:
+                self.cache.put(
+                    keys[i],
+                    results[i],
+                    metadata={
+                        "times": times,
+                        "simulation_number": simulation_number,
+                        "time_limit": limits[i][0],
+                        "cost_limit": limits[i][1],
+                        "template": self.exporter.template_digest(),
+                    },
+                )
+        return results
+
+    def verify_many(self, jobs, workers=None, timeout=60 * 60 / 2, keep_files=False):
+        """Verify the jobs concurrently, each one on its own copy of the model. A job
+        is a dictionary with optional keys simulation_number, time_limit, cost_limit
+        and times (defense periods, see set_defense_times), and widths with the
+        simulator backends (see verify). Return the results in the order of the jobs,
+        with the subprocess.TimeoutExpired exception of the jobs that timed out. The
+        pool is made of threads, each one waiting for its own verifyta process."""
+        return list(self.iter_verify(jobs, workers, timeout, keep_files))
+
+    def iter_verify(self, jobs, workers=None, timeout=60 * 60 / 2, keep_files=False):
+        """Results of verify_many yielded in the order of the jobs as soon as they are
+        known. The jobs are submitted in order, and closing the generator cancels the
+        jobs that have not started (waiting for the running ones)."""
+        if self.backend != "verifyta":
+            for job in jobs:
+                yield self.simulator.estimate(
+                    job.get("simulation_number", 10000),
+                    time_limit=job.get("time_limit"),
+                    cost_limit=job.get("cost_limit"),
+                    times=job.get("times"),
+                    widths=job.get("widths"),
+                )
+            return
+        base_name, extension = os.path.splitext(self.file_name)
+        models = [
+            (
+                f"{base_name}-job{i}{extension}",
+                self.exporter.render_declaration(job.get("times")),
+                self.exporter.render_queries(
+                    job.get("simulation_number", 10000),
+                    time_limit=job.get("time_limit"),
+                    cost_limit=job.get("cost_limit"),
+                ),
+            )
+            for i, job in enumerate(jobs)
+        ]
+
+        def run_job(i):
+            file_name, declaration_xml, queries_xml = models[i]
+            self.exporter.write_model(declaration_xml, queries_xml, file_name)
+            try:
+                return self.run_verifyta(
+                    file_name,
+                    time_limit=jobs[i].get("time_limit"),
+                    cost_limit=jobs[i].get("cost_limit"),
+                    timeout=timeout,
+                )
+            finally:
+                if not keep_files:
+                    os.remove(file_name)
+
+        def run(i):
+            _, declaration_xml, queries_xml = models[i]
+            times = {d.name: d.period for d in self.adg.defenses}
+            times.update(jobs[i].get("times", {}))
+            try:
+                return self.cached(
+                    lambda: run_job(i),
+                    declaration_xml,
+                    queries_xml,
+                    metadata={
+                        "times": times,
+                        "simulation_number": jobs[i].get("simulation_number", 10000),
+                        "time_limit": jobs[i].get("time_limit"),
+                        "cost_limit": jobs[i].get("cost_limit"),
+                    },
+                )
+            except subprocess.TimeoutExpired as timeout_expired:
+                return timeout_expired
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(run, i) for i in range(len(jobs))]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            executor.shutdown(cancel_futures=True)
 
     def evaluate(
         self, times, simulation_number=10000, time_limit=None, cost_limit=None
     ):
+        """Score of the defense periods, a dictionary (see set_defense_times) or a
+        vector in the order of period_names, infinity if the strategy is not found."""
+        if time_limit is not None and cost_limit is not None:
+            raise ValueError("The score is of a single strategy, give one limit")
         if type(times) is not dict:
-            keys = sorted([d.name for d in self.adg.defenses])
-            times_dict = dict()
-            for i in range(len(keys)):
-                times_dict[keys[i]] = times[i]
-            times = times_dict
-
+            times = dict(zip(self.period_names(), times))
         self.set_defense_times(times)
-        self.verify(self.file_name, cost_limit=cost_limit)
-        return score(*self.verify(self.file_name))
+        return score_result(
+            self.verify(
+                self.file_name,
+                simulation_number,
+                time_limit=time_limit,
+                cost_limit=cost_limit,
+            )
+        )
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def nondominated_sort(objectives):
+    """Indices of the rows of objectives (minimization) in successive Pareto fronts,
+    the first one being the nondominated rows."""
+    objectives = np.asarray(objectives, dtype=float)
+    lower_equal = (objectives[:, None, :] <= objectives[None, :, :]).all(axis=2)
+    lower = (objectives[:, None, :] < objectives[None, :, :]).any(axis=2)
+    # dominated[i, j]: the row i dominates the row j
+    dominated = lower_equal & lower
+    counts = dominated.sum(axis=0)
+    fronts = []
+    front = np.flatnonzero(counts == 0)
+    while len(front):
+        fronts.append(front)
+        counts = counts - dominated[front].sum(axis=0)
+        counts[front] = -1
+        front = np.flatnonzero(counts == 0)
+    return fronts
+
+
+def crowding_distance(objectives):
+    """Crowding distance of the rows of objectives of a front: the sum over the
+    objectives of the normalized gaps between the neighbors of each row, infinite for
+    the extreme rows."""
+    objectives = np.asarray(objectives, dtype=float)
+    distance = np.zeros(len(objectives))
+    for column in objectives.T:
+        order = np.argsort(column, kind="stable")
+        distance[order[[0, -1]]] = np.inf
+        span = column[order[-1]] - column[order[0]]
+        if span > 0 and len(order) > 2:
+            distance[order[1:-1]] += (column[order[2:]] - column[order[:-2]]) / span
+    return distance
+
+
+def simulated_binary_crossover(a, b, rng, eta=15):
+    """Two children of the points a and b of [0, 1] ** n, spread around them as the
+    children of a one point crossover of binary strings (a larger eta keeps them
+    closer to the parents)."""
+    u = rng.random(len(a))
+    beta = np.where(
+        u <= 0.5, (2 * u) ** (1 / (eta + 1)), (1 / (2 * (1 - u))) ** (1 / (eta + 1))
+    )
+    first = ((1 + beta) * a + (1 - beta) * b) / 2
+    second = ((1 - beta) * a + (1 + beta) * b) / 2
+    return np.clip(first, 0, 1), np.clip(second, 0, 1)
+
+
+def polynomial_mutation(point, rng, probability=None, eta=20):
+    """Point of [0, 1] ** n with each coordinate mutated with the probability (1 / n
+    by default) by a polynomially distributed step."""
+    probability = 1 / len(point) if probability is None else probability
+    u = rng.random(len(point))
+    step = np.where(
+        u < 0.5, (2 * u) ** (1 / (eta + 1)) - 1, 1 - (2 * (1 - u)) ** (1 / (eta + 1))
+    )
+    mutated = rng.random(len(point)) < probability
+    return np.clip(point + mutated * step, 0, 1)
@@ -0,0 +1,445 @@
+import math
+import random
+from statistics import NormalDist, stdev
+import numpy as np
+
+from admdp import StateType, EdgeType
+from compiled import CompiledADMDP
+
+
+def uniform_policy(state, edges, rng):
+    """Attacker policy choosing uniformly among the edges of an attacker state."""
+    return rng.choice(edges)
+
+
+def histogram(values, bins=32):
+    """Lower bound, upper bound and counts of equal width bins of the values."""
+    if not values:
+        return None, None, None
+    low, up = min(values), max(values)
+    if low == up:
+        return low, up, [len(values)]
+    counts = [0] * bins
+    width = (up - low) / bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return low, up, counts
+
+
+def proportion_interval(successes, runs, confidence=0.95):
+    """Wilson score interval of a probability."""
+    if runs == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = successes / runs
+    center = (p + z**2 / (2 * runs)) / (1 + z**2 / runs)
+    half_width = (
+        z * math.sqrt(p * (1 - p) / runs + z**2 / (4 * runs**2)) / (1 + z**2 / runs)
+    )
+    return max(center - half_width, 0.0), min(center + half_width, 1.0)
+
+
+def mean_interval_width(values, confidence=0.95):
+    """Width of the normal confidence interval of the mean of the values."""
+    if len(values) < 2:
+        return math.inf
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    return 2 * z * stdev(values) / math.sqrt(len(values))
+
+
+def converged(times, costs, successes, widths, confidence=0.95):
+    """Tell if the confidence intervals are narrower than the target widths."""
+    for name, width in widths.items():
+        if name == "time":
+            interval_width = mean_interval_width(times, confidence)
+        elif name == "cost":
+            interval_width = mean_interval_width(costs, confidence)
+        else:
+            low, up = proportion_interval(successes, len(times), confidence)
+            interval_width = up - low
+        if interval_width > width:
+            return False
+    return True
+
+
+def summarize(times, costs, successes, confidence=0.95, bins=32):
+    """Result with the same shape as optimizer.extract_formulas."""
+    runs = len(times)
+    P_success_inf, P_success_sup = proportion_interval(successes, runs, confidence)
+    return (
+        sum(times) / runs,
+        sum(costs) / runs,
+        (P_success_inf, P_success_sup, confidence),
+        histogram(times, bins),
+        histogram(costs, bins),
+    )
+
+
+class Simulator:
+    """Monte Carlo simulation of the ADMDP with the semantics of the Uppaal model made
+    by UppaalExporter. The attacker policy is called in the attacker states with the
+    state, its edges and the random generator, and returns the chosen edge. Decisions
+    take no time, activation costs are paid without time passing, and in the no
+    activation states time passes until an attack completion or the period of a defense
+    with an edge in the state (the clocks guards), one of the enabled edges being chosen
+    uniformly. A run that can't progress stops unsuccessfully."""
+
+    def __init__(self, admdp, policy=None, seed=None):
+        self.admdp = admdp
+        self.adg = admdp.adg
+        self.policy = policy if policy else uniform_policy
+        self.rng = random.Random(seed)
+
+    def run(self, time_bound=math.inf, cost_bound=math.inf, times=None):
+        """Time, cost and success of a run stopped at the goal or at the bounds.
+        times overrides the periods of the defenses (dictionary with the names of the
+        defenses as key)."""
+        times = times if times else dict()
+        periods = {
+            defense.name: times.get(defense.name, defense.period)
+            for defense in self.adg.defenses
+        }
+        activation_time = dict()
+        reset_time = {defense.name: 0 for defense in self.adg.defenses}
+        time, cost = 0, 0
+        state = self.admdp.initial_state
+        while not state.accepting:
+            if state.state_type == StateType.NORMAL:
+                if not state.edges:
+                    return time, cost, False
+                edge = self.policy(state, state.edges, self.rng)
+                if edge.type == EdgeType.ACTIVATION:
+                    activation_time[edge.attack.name] = time
+            elif state.state_type == StateType.ACTIVATION_COST:
+                if cost + state.attack.activation_cost > cost_bound:
+                    return time, cost_bound, False
+                cost += state.attack.activation_cost
+                edge = state.edges[0]
+                activation_time[edge.attack.name] = time
+            elif state.state_type in (StateType.COMPLETION, StateType.MTD):
+                edge = self.rng.choices(
+                    state.edges,
+                    weights=[edge.success_probability for edge in state.edges],
+                )[0]
+            else:
+                activated = self.adg.unmask(state.activated)
+                delay = min(
+                    [
+                        attack.completion_time - (time - activation_time[attack.name])
+                        for attack in activated
+                    ]
+                    + [
+                        periods[edge.defense.name]
+                        - (time - reset_time[edge.defense.name])
+                        for edge in state.edges
+                        if hasattr(edge, "defense")
+                    ],
+                    default=math.inf,
+                )
+                delay = max(delay, 0)
+                rate = sum(attack.proportional_cost or 0 for attack in activated)
+                if time + delay > time_bound:
+                    return time_bound, cost + rate * (time_bound - time), False
+                if cost + rate * delay > cost_bound:
+                    return time + (cost_bound - cost) / rate, cost_bound, False
+                time += delay
+                cost += rate * delay
+                enabled = [
+                    edge
+                    for edge in state.edges
+                    if self.enabled(edge, time, activation_time, reset_time, periods)
+                ]
+                if not enabled:
+                    return time, cost, False
+                edge = self.rng.choice(enabled)
+                if edge.type in (EdgeType.TO_DEFENSE, EdgeType.LOOP_DEFENSE):
+                    reset_time[edge.defense.name] = time
+            state = edge.destination
+        return time, cost, True
+
+    @staticmethod
+    def enabled(edge, time, activation_time, reset_time, periods):
+        """Guard of the uncontrollable edges of the no activation states."""
+        if edge.type == EdgeType.TO_COMPLETION:
+            attack = edge.attack
+            return time - activation_time[attack.name] >= attack.completion_time
+        defense = edge.defense
+        return time - reset_time[defense.name] >= periods[defense.name] and all(
+            time - reset_time[follower.name] < periods[follower.name]
+            for follower in defense.followers
+        )
+
+    def simulate(
+        self, runs, time_bound=math.inf, cost_bound=math.inf, times=None, limit=None
+    ):
+        """Times, costs and number of successes of the runs. limit is a function of
+        the time and the cost of a successful run telling if it counts as a
+        success."""
+        times_, costs, successes = [], [], 0
+        for _ in range(runs):
+            time, cost, success = self.run(time_bound, cost_bound, times)
+            times_.append(time)
+            costs.append(cost)
+            if success and (limit is None or limit(time, cost)):
+                successes += 1
+        return times_, costs, successes
+
+    def sample(
+        self,
+        simulation_number,
+        time_bound=math.inf,
+        cost_bound=math.inf,
+        times=None,
+        limit=None,
+        widths=None,
+        batch_size=1000,
+        confidence=0.95,
+    ):
+        """Like simulate, but with widths (see estimate) the runs are made by batches of
+        batch_size until the confidence intervals are narrow enough or
+        simulation_number runs are made."""
+        if not widths:
+            return self.simulate(
+                simulation_number, time_bound, cost_bound, times, limit
+            )
+        times_, costs, successes = [], [], 0
+        while len(times_) < simulation_number:
+            batch = self.simulate(
+                min(batch_size, simulation_number - len(times_)),
+                time_bound,
+                cost_bound,
+                times,
+                limit,
+            )
+            times_ += batch[0]
+            costs += batch[1]
+            successes += batch[2]
+            if converged(times_, costs, successes, widths, confidence):
+                break
+        return times_, costs, successes
+
+    def estimate(
+        self,
+        simulation_number=10000,
+        time_limit=None,
+        cost_limit=None,
+        infinity=100000,
+        times=None,
+        widths=None,
+        batch_size=1000,
+    ):
+        """Estimations of the queries of UppaalExporter.make_queries under the policy,
+        with the same shape as the results of Optimizer.verify. widths is a dictionary
+        of target widths of the confidence intervals with keys among "time", "cost" and
+        "probability": the simulations of each strategy stop as soon as these intervals
+        are narrow enough, simulation_number being the maximum number of runs. The
+        numbers of runs actually made are in self.runs_used."""
+        strategies = []
+        # Fast strategy
+        if time_limit is None and cost_limit is None:
+            strategies.append(
+                dict(time_bound=10000, limit=lambda time, cost: time <= 100)
+            )
+        # Cheap strategy
+        if time_limit is not None:
+            strategies.append(
+                dict(time_bound=infinity, limit=lambda time, cost: time <= time_limit)
+            )
+        # Limited cost strategy
+        if cost_limit is not None:
+            strategies.append(
+                dict(cost_bound=infinity, limit=lambda time, cost: cost <= cost_limit)
+            )
+        results = []
+        self.runs_used = []
+        for strategy in strategies:
+            samples = self.sample(
+                simulation_number,
+                times=times,
+                widths=widths,
+                batch_size=batch_size,
+                **strategy,
+            )
+            self.runs_used.append(len(samples[0]))
+            results.append(summarize(*samples))
+        return tuple(results) if len(results) > 1 else results[0]
+
+
+class BatchSimulator(Simulator):
+    """Simulator advancing all the runs in lock-step with NumPy arrays over the tables
+    of a CompiledADMDP (compiled from the admdp if not given). The policy is an array of
+    weights of the edges (uniform choice among the edges of the attacker states by
+    default)."""
+
+    def __init__(self, admdp=None, policy=None, seed=None, compiled=None):
+        self.admdp = admdp
+        self.adg = admdp.adg if admdp is not None else None
+        self.compiled = compiled if compiled is not None else CompiledADMDP(admdp)
+        self.policy = (
+            np.asarray(policy, dtype=float)
+            if policy is not None
+            else np.ones(self.compiled.edges_number)
+        )
+        if self.policy.shape != (self.compiled.edges_number,):
+            raise ValueError(
+                f"The policy has {self.policy.size} weights for "
+                f"{self.compiled.edges_number} edges"
+            )
+        self.rng = np.random.default_rng(seed)
+        self.steps = 0
+
+    def choose(self, edges, weights):
+        """Random edge of each row of the padded edges matrix with the given weights,
+        -1 if no edge has a positive weight."""
+        weights = np.where(edges >= 0, weights, 0.0)
+        total = weights.sum(axis=1)
+        threshold = self.rng.random(len(edges)) * total
+        choice = (np.cumsum(weights, axis=1) > threshold[:, None]).argmax(axis=1)
+        chosen = edges[np.arange(len(edges)), choice]
+        chosen[total <= 0] = -1
+        return chosen
+
+    def run_batch(self, runs, time_bound=math.inf, cost_bound=math.inf, times=None):
+        """Times, costs and successes arrays of the runs (see Simulator.run)."""
+        compiled = self.compiled
+        periods = compiled.periods(times)
+        state = np.full(runs, compiled.initial)
+        time = np.zeros(runs)
+        cost = np.zeros(runs)
+        success = np.zeros(runs, dtype=bool)
+        activation_time = np.zeros((runs, len(compiled.completion_time)))
+        reset_time = np.zeros((runs, len(periods)))
+        active = np.arange(runs)
+        while active.size:
+            s = state[active]
+            state_type = compiled.state_type[s]
+            stopped = compiled.accepting[s].copy()
+            success[active[stopped]] = True
+            edge = np.full(active.size, -1)
+
+            # Attacker decisions
+            deciding = (state_type == StateType.NORMAL.value) & ~stopped
+            edges = compiled.state_edges[s[deciding]]
+            edge[deciding] = self.choose(edges, self.policy[edges])
+
+            # Activation costs
+            paying = state_type == StateType.ACTIVATION_COST.value
+            attack_cost = compiled.activation_cost[compiled.state_attack[s[paying]]]
+            over = cost[active[paying]] + attack_cost > cost_bound
+            cost[active[paying]] = np.where(
+                over, cost_bound, cost[active[paying]] + attack_cost
+            )
+            stopped[np.flatnonzero(paying)[over]] = True
+            paying[paying] = ~over
+            edge[paying] = compiled.state_edges[s[paying], 0]
+
+            # Branchpoints
+            branching = (state_type == StateType.COMPLETION.value) | (
+                state_type == StateType.MTD.value
+            )
+            edges = compiled.state_edges[s[branching]]
+            edge[branching] = self.choose(edges, compiled.edge_probability[edges])
+
+            # Time elapse until the clocks guards
+            waiting = np.flatnonzero(state_type == StateType.NO_ACTIVATION.value)
+            if waiting.size:
+                edge[waiting], time_stopped = self.elapse(
+                    active[waiting],
+                    s[waiting],
+                    time,
+                    cost,
+                    activation_time,
+                    reset_time,
+                    periods,
+                    time_bound,
+                    cost_bound,
+                )
+                stopped[waiting[time_stopped]] = True
+
+            # Take the edges
+            moving = ~stopped & (edge >= 0)
+            taken = edge[moving]
+            active = active[moving]
+            edge_type = compiled.edge_type[taken]
+            activation = edge_type == EdgeType.ACTIVATION.value
+            activation_time[
+                active[activation], compiled.edge_attack[taken[activation]]
+            ] = time[active[activation]]
+            reset = (edge_type == EdgeType.TO_DEFENSE.value) | (
+                edge_type == EdgeType.LOOP_DEFENSE.value
+            )
+            reset_time[active[reset], compiled.edge_defense[taken[reset]]] = time[
+                active[reset]
+            ]
+            state[active] = compiled.edge_destination[taken]
+            self.steps += active.size
+        return time, cost, success
+
+    def elapse(
+        self,
+        runs,
+        states,
+        time,
+        cost,
+        activation_time,
+        reset_time,
+        periods,
+        time_bound,
+        cost_bound,
+    ):
+        """Let the time pass for the runs in no activation states, and choose one of
+        the enabled edges. Return the chosen edges and the runs stopped by the
+        bounds."""
+        compiled = self.compiled
+        remaining_attacks = np.where(
+            compiled.activated[states],
+            compiled.completion_time - (time[runs, None] - activation_time[runs]),
+            math.inf,
+        )
+        remaining_defenses = np.where(
+            compiled.state_defenses[states],
+            periods - (time[runs, None] - reset_time[runs]),
+            math.inf,
+        )
+        delay = np.maximum(
+            np.minimum(
+                remaining_attacks.min(axis=1, initial=math.inf),
+                remaining_defenses.min(axis=1, initial=math.inf),
+            ),
+            0,
+        )
+        rate = compiled.cost_rate[states]
+        time_over = time[runs] + delay > time_bound
+        cost_over = ~time_over & (cost[runs] + rate * delay > cost_bound)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delay = np.where(time_over, time_bound - time[runs], delay)
+            delay = np.where(cost_over, (cost_bound - cost[runs]) / rate, delay)
+        time[runs] += delay
+        cost[runs] = np.where(cost_over, cost_bound, cost[runs] + rate * delay)
+
+        edges = compiled.state_edges[states]
+        valid = edges >= 0
+        edge_type = compiled.edge_type[edges]
+        rows = np.arange(len(runs))[:, None]
+        attack = compiled.edge_attack[edges]
+        attack_enabled = (edge_type == EdgeType.TO_COMPLETION.value) & (
+            time[runs, None] - activation_time[runs[:, None], np.maximum(attack, 0)]
+            >= compiled.completion_time[np.maximum(attack, 0)]
+        )
+        clocks = time[runs, None] - reset_time[runs]
+        # A defense waits for its followers (see UppaalExporter)
+        blocked = (clocks >= periods).astype(int) @ compiled.followers.T.astype(int)
+        defense_enabled = (clocks >= periods) & (blocked == 0)
+        defense = compiled.edge_defense[edges]
+        defense_enabled = (defense >= 0) & defense_enabled[rows, np.maximum(defense, 0)]
+        enabled = valid & (attack_enabled | defense_enabled)
+        stopped = time_over | cost_over
+        return self.choose(edges, enabled.astype(float)), stopped
+
+    def simulate(
+        self, runs, time_bound=math.inf, cost_bound=math.inf, times=None, limit=None
+    ):
+        times_, costs, success = self.run_batch(runs, time_bound, cost_bound, times)
+        if limit is not None:
+            success &= limit(times_, costs)
+        return times_.tolist(), costs.tolist(), int(success.sum())
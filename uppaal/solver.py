@@ -0,0 +1,333 @@
+import math
+from collections import deque
+
+import numpy as np
+from scipy.sparse import csr_matrix, identity
+from scipy.sparse.linalg import spsolve
+
+from admdp import StateType, EdgeType
+from compiled import CompiledADMDP
+
+
+class Solver:
+    """Exact optimal expected time or cost of the attacker to reach the goal, for
+    integer completion times and defense periods. The ADMDP is unfolded into the
+    discrete product of its states with the clocks: the phase of the defenses (time
+    modulo the least common multiple of the periods), the remaining times of the
+    activated attacks and the defenses due at the current instant. In the attacker
+    states the attacker chooses an edge, the other nodes are stochastic (branchpoints,
+    and the uniform choice among the enabled edges once time has passed in the no
+    activation states, as in simulator.Simulator).
+
+    The expected time or cost is to reach the goal, without the time or cost limits of
+    the Uppaal strategies: the nodes from which the goal can't be reached almost
+    surely have an infinite value. The optimal policy is computed by policy iteration,
+    each policy being evaluated with a sparse linear solver.
+
+    The number of nodes grows with the periods and the completion times: the
+    completion times and the periods are rounded to multiples of time_step (at least
+    one step), which is exact with the default step of 1 and integer times, and coarser
+    steps give smaller approximate products. A ValueError is raised if there are more
+    than max_nodes nodes."""
+
+    def __init__(self, admdp, times=None, time_step=1, compiled=None, max_nodes=10**6):
+        self.admdp = admdp
+        self.compiled = compiled if compiled is not None else CompiledADMDP(admdp)
+        self.time_step = time_step
+        self.periods = [
+            max(1, round(period / time_step)) for period in self.compiled.periods(times)
+        ]
+        self.completion_time = [
+            max(1, round(time / time_step)) for time in self.compiled.completion_time
+        ]
+        self.max_nodes = max_nodes
+        self.build_product()
+
+    def build_product(self):
+        """Explore the reachable nodes of the product, a node being a tuple of the
+        CompiledADMDP state, the phase, the remaining times of the attacks and the
+        bitmask of the due defenses (in steps). Each transition goes from a node to a
+        node along an edge with a probability (1 for the choices of the attacker), a
+        time and a cost."""
+        compiled = self.compiled
+        completion_time = self.completion_time
+        activation_cost = compiled.activation_cost.tolist()
+        cost_rate = compiled.cost_rate.tolist()
+        state_type = compiled.state_type.tolist()
+        activated = [np.flatnonzero(row).tolist() for row in compiled.activated]
+        offsets = compiled.edge_offsets.tolist()
+        edge_type = compiled.edge_type.tolist()
+        edge_attack = compiled.edge_attack.tolist()
+        edge_defense = compiled.edge_defense.tolist()
+        edge_probability = compiled.edge_probability.tolist()
+        edge_destination = compiled.edge_destination.tolist()
+        followers = [np.flatnonzero(row).tolist() for row in compiled.followers]
+        # Defenses whose clocks matter in each state (see ADMDP.prune)
+        defended = [
+            sum(1 << defense for defense in np.flatnonzero(row).tolist())
+            for row in compiled.state_defenses
+        ]
+        periods = self.periods
+        hyperperiod = math.lcm(*periods) if periods else 1
+        attacks_number = len(completion_time)
+
+        def remaining_of(destination, remaining):
+            """Forget the remaining times of the attacks deactivated by an edge."""
+            kept = [0] * attacks_number
+            for attack in activated[destination]:
+                kept[attack] = remaining[attack]
+            return tuple(kept)
+
+        initial = (compiled.initial, 0, (0,) * attacks_number, 0)
+        self.index = {initial: 0}
+        self.nodes = [initial]
+        self.decision = []
+        self.accepting = []
+        sources, targets, probabilities, times, costs = [], [], [], [], []
+        self.edges = []
+        frontier = deque([initial])
+
+        def add(source, target, edge, probability=1.0, time=0, cost=0.0):
+            if target not in self.index:
+                if len(self.nodes) >= self.max_nodes:
+                    raise ValueError(
+                        f"More than {self.max_nodes} product nodes, see time_step"
+                    )
+                self.index[target] = len(self.nodes)
+                self.nodes.append(target)
+                frontier.append(target)
+            sources.append(source)
+            targets.append(self.index[target])
+            self.edges.append(edge)
+            probabilities.append(probability)
+            times.append(time)
+            costs.append(cost)
+
+        while frontier:
+            node = frontier.popleft()
+            source = self.index[node]
+            state, phase, remaining, due = node
+            kind = state_type[state]
+            self.decision.append(kind == StateType.NORMAL.value)
+            self.accepting.append(bool(compiled.accepting[state]))
+            if self.accepting[-1]:
+                continue
+            edges = range(offsets[state], offsets[state + 1])
+            if kind != StateType.NO_ACTIVATION.value:
+                for edge in edges:
+                    destination = edge_destination[edge]
+                    attack = edge_attack[edge]
+                    edge_remaining = list(remaining)
+                    if edge_type[edge] == EdgeType.ACTIVATION.value:
+                        edge_remaining[attack] = completion_time[attack]
+                    add(
+                        source,
+                        (
+                            destination,
+                            phase,
+                            remaining_of(destination, edge_remaining),
+                            due,
+                        ),
+                        edge,
+                        probability=(
+                            edge_probability[edge]
+                            if kind != StateType.NORMAL.value
+                            else 1.0
+                        ),
+                        cost=(
+                            activation_cost[attack]
+                            if kind == StateType.ACTIVATION_COST.value
+                            else 0.0
+                        ),
+                    )
+                continue
+
+            # Time elapse until the next attack completion or defense period
+            due &= defended[state]
+            if due or any(remaining[attack] == 0 for attack in activated[state]):
+                delay = 0
+            else:
+                delay = min(
+                    [remaining[attack] for attack in activated[state]]
+                    + [
+                        period - phase % period
+                        for defense, period in enumerate(periods)
+                        if defended[state] >> defense & 1
+                    ],
+                    default=0,
+                )
+                phase = (phase + delay) % hyperperiod
+                remaining = tuple(value - delay if value else 0 for value in remaining)
+                due = sum(
+                    1 << defense
+                    for defense, period in enumerate(periods)
+                    if defended[state] >> defense & 1 and phase % period == 0
+                )
+            enabled = [
+                edge
+                for edge in edges
+                if (
+                    edge_type[edge] == EdgeType.TO_COMPLETION.value
+                    and remaining[edge_attack[edge]] == 0
+                )
+                or (
+                    edge_defense[edge] >= 0
+                    and due & (1 << edge_defense[edge])
+                    and not any(
+                        due & (1 << follower)
+                        for follower in followers[edge_defense[edge]]
+                    )
+                )
+            ]
+            for edge in enabled:
+                destination = edge_destination[edge]
+                add(
+                    source,
+                    (
+                        destination,
+                        phase,
+                        remaining_of(destination, remaining),
+                        (
+                            due & ~(1 << edge_defense[edge])
+                            if edge_defense[edge] >= 0
+                            else due
+                        ),
+                    ),
+                    edge,
+                    probability=1 / len(enabled),
+                    time=delay * self.time_step,
+                    cost=cost_rate[state] * delay * self.time_step,
+                )
+
+        self.decision = np.array(self.decision, dtype=bool)
+        self.accepting = np.array(self.accepting, dtype=bool)
+        self.sources = np.array(sources, dtype=np.int64)
+        self.targets = np.array(targets, dtype=np.int64)
+        self.probabilities = np.array(probabilities, dtype=float)
+        self.times = np.array(times, dtype=float)
+        self.costs = np.array(costs, dtype=float)
+
+    @property
+    def nodes_number(self):
+        return len(self.nodes)
+
+    def almost_sure(self):
+        """Nodes from which the attacker can reach the goal with probability 1, and
+        the transitions staying in these nodes."""
+        alive = np.ones(self.nodes_number, dtype=bool)
+        usable = np.ones(len(self.sources), dtype=bool)
+        while True:
+            # Nodes reaching the goal with the usable transitions
+            reach = self.accepting & alive
+            while True:
+                step = np.zeros(self.nodes_number, dtype=bool)
+                step[self.sources[usable & reach[self.targets]]] = True
+                step |= reach
+                step &= alive
+                if (step == reach).all():
+                    break
+                reach = step
+            usable &= reach[self.targets]
+            # Stochastic nodes with a transition leaving the nodes are lost
+            leaving = np.zeros(self.nodes_number, dtype=bool)
+            leaving[self.sources[~usable & ~self.decision[self.sources]]] = True
+            new_alive = reach & ~leaving
+            usable &= new_alive[self.sources] & new_alive[self.targets]
+            if (new_alive == alive).all():
+                return alive, usable
+            alive = new_alive
+
+    def solve(self, objective="time", tolerance=1e-9, max_iterations=1000):
+        """Optimal expected time (objective "time") or cost (objective "cost") from
+        the initial node and the optimal policy, a dictionary from the attacker nodes
+        (see build_product) to the chosen edges (indices of the CompiledADMDP). Costs
+        are minimized with the time as a tie-breaker, so that the policy reaches the
+        goal."""
+        alive, usable = self.almost_sure()
+        self.values = np.full(self.nodes_number, math.inf)
+        if not alive[0]:
+            self.policy = dict()
+            return math.inf, self.policy
+        rewards = self.times if objective == "time" else self.costs + 1e-9 * self.times
+        chosen = self.initial_policy(alive, usable)
+        for _ in range(max_iterations):
+            values = self.evaluate(chosen, alive, rewards)
+            # Greedy improvement, keeping the current choice unless strictly better
+            q_values = rewards + values[self.targets]
+            q_values[~usable] = math.inf
+            best = np.full(self.nodes_number, math.inf)
+            decisions = usable & self.decision[self.sources]
+            np.minimum.at(best, self.sources[decisions], q_values[decisions])
+            current = q_values[chosen]
+            improvable = np.zeros(self.nodes_number, dtype=bool)
+            improvable[self.sources[chosen]] = best[
+                self.sources[chosen]
+            ] < current - tolerance * np.maximum(1, np.abs(current))
+            if not improvable.any():
+                break
+            candidates = decisions & (
+                q_values <= best[self.sources] + tolerance * np.abs(best[self.sources])
+            )
+            candidates &= improvable[self.sources]
+            chosen &= ~improvable[self.sources]
+            first = np.unique(self.sources[candidates], return_index=True)[1]
+            chosen[np.flatnonzero(candidates)[first]] = True
+        if objective == "cost":
+            values = self.evaluate(chosen, alive, self.costs)
+        self.values = values
+        self.chosen = chosen
+        self.policy = {
+            self.nodes[self.sources[transition]]: self.edges[transition]
+            for transition in np.flatnonzero(chosen)
+        }
+        return values[0], self.policy
+
+    def initial_policy(self, alive, usable):
+        """Proper policy getting closer to the goal (in number of transitions) at each
+        attacker decision."""
+        distance = np.full(self.nodes_number, math.inf)
+        distance[self.accepting & alive] = 0
+        level = 0
+        while True:
+            level += 1
+            closer = usable & (distance[self.targets] == level - 1)
+            reached = np.zeros(self.nodes_number, dtype=bool)
+            reached[self.sources[closer]] = True
+            reached &= distance == math.inf
+            if not reached.any():
+                break
+            distance[reached] = level
+        decisions = usable & self.decision[self.sources]
+        decisions &= distance[self.targets] == distance[self.sources] - 1
+        chosen = np.zeros(len(self.sources), dtype=bool)
+        first = np.unique(self.sources[decisions], return_index=True)[1]
+        chosen[np.flatnonzero(decisions)[first]] = True
+        return chosen
+
+    def evaluate(self, chosen, alive, rewards):
+        """Expected rewards to the goal under the policy given by the chosen
+        transitions, solving the linear system of the alive non accepting nodes."""
+        taken = (chosen | ~self.decision[self.sources]) & alive[self.sources]
+        unknown = np.flatnonzero(alive & ~self.accepting)
+        position = np.full(self.nodes_number, -1)
+        position[unknown] = np.arange(len(unknown))
+        inside = taken & (position[self.targets] >= 0)
+        transitions = csr_matrix(
+            (
+                self.probabilities[inside],
+                (position[self.sources[inside]], position[self.targets[inside]]),
+            ),
+            shape=(len(unknown), len(unknown)),
+        )
+        expected_rewards = np.zeros(len(unknown))
+        np.add.at(
+            expected_rewards,
+            position[self.sources[taken]],
+            (self.probabilities * rewards)[taken],
+        )
+        values = np.full(self.nodes_number, math.inf)
+        values[self.accepting & alive] = 0
+        values[unknown] = np.atleast_1d(
+            spsolve((identity(len(unknown)) - transitions).tocsc(), expected_rewards)
+        )
+        return values
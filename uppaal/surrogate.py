@@ -0,0 +1,109 @@
+import math
+
+import numpy as np
+from scipy.linalg import LinAlgError, cho_factor, cho_solve
+from scipy.optimize import minimize
+from scipy.stats import norm
+
+
+def matern52(X1, X2, length_scales, variance):
+    """Matern 5/2 covariance between the rows of X1 and X2."""
+    difference = (X1[:, None, :] - X2[None, :, :]) / length_scales
+    r = math.sqrt(5) * np.sqrt((difference**2).sum(axis=2))
+    return variance * (1 + r + r**2 / 3) * np.exp(-r)
+
+
+def expected_improvement(mean, std, best, xi=0.0):
+    """Expected improvement below best of normal predictions (minimization)."""
+    std = np.maximum(std, 1e-12)
+    z = (best - xi - mean) / std
+    return (best - xi - mean) * norm.cdf(z) + std * norm.pdf(z)
+
+
+class GaussianProcess:
+    """Gaussian process regression of noisy evaluations (Monte Carlo estimations) with
+    a Matern 5/2 kernel, one length scale per input (the inputs are expected in
+    [0, 1]) and the standardized outputs. The length scales, the variance and the
+    noise maximize the log marginal likelihood, from restarts random starting
+    points."""
+
+    # Bounds of the logarithms of the length scales, variance and noise
+    log_bounds = ((math.log(1e-2), math.log(1e1)), (math.log(5e-2), math.log(2e1)))
+    log_noise_bounds = (math.log(1e-6), math.log(1.0))
+
+    def __init__(self, restarts=3, seed=None):
+        self.restarts = restarts
+        self.rng = np.random.default_rng(seed)
+        self.parameters = None
+
+    def negative_log_likelihood(self, parameters, X, y):
+        length_scales = np.exp(parameters[:-2])
+        variance, noise = np.exp(parameters[-2:])
+        K = matern52(X, X, length_scales, variance) + noise * np.eye(len(X))
+        try:
+            factor = cho_factor(K, lower=True)
+        except LinAlgError:
+            return 1e10
+        alpha = cho_solve(factor, y)
+        return (
+            y @ alpha / 2
+            + np.log(np.diag(factor[0])).sum()
+            + len(X) * math.log(2 * math.pi) / 2
+        )
+
+    def fit(self, X, y, optimize=True):
+        """Condition the process on the evaluations y at X, keeping the previous
+        hyperparameters unless optimize."""
+        self.X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.offset = y.mean()
+        self.scale = y.std() if y.std() > 0 else 1.0
+        self.y = (y - self.offset) / self.scale
+        dimension = self.X.shape[1]
+        bounds = [self.log_bounds[0]] * dimension + [
+            self.log_bounds[1],
+            self.log_noise_bounds,
+        ]
+        if optimize or self.parameters is None:
+            starts = [np.array([math.log(0.3)] * dimension + [0.0, math.log(1e-2)])]
+            starts += [
+                np.array([self.rng.uniform(low, up) for low, up in bounds])
+                for _ in range(self.restarts)
+            ]
+            if self.parameters is not None:
+                starts.append(self.parameters)
+            best = None
+            for start in starts:
+                result = minimize(
+                    self.negative_log_likelihood,
+                    start,
+                    args=(self.X, self.y),
+                    method="L-BFGS-B",
+                    bounds=bounds,
+                )
+                if best is None or result.fun < best.fun:
+                    best = result
+            self.parameters = best.x
+        self.length_scales = np.exp(self.parameters[:-2])
+        self.variance, self.noise = np.exp(self.parameters[-2:])
+        K = matern52(self.X, self.X, self.length_scales, self.variance)
+        # Jitter if the noise is too low for a numerically positive definite matrix
+        for jitter in (0.0, 1e-8, 1e-6, 1e-4):
+            try:
+                self.factor = cho_factor(
+                    K + (self.noise + jitter) * np.eye(len(self.X)), lower=True
+                )
+                break
+            except LinAlgError:
+                continue
+        self.alpha = cho_solve(self.factor, self.y)
+        return self
+
+    def predict(self, X):
+        """Mean and standard deviation of the predictions at X."""
+        X = np.asarray(X, dtype=float)
+        K = matern52(X, self.X, self.length_scales, self.variance)
+        mean = K @ self.alpha
+        variance = self.variance - (K * cho_solve(self.factor, K.T).T).sum(axis=1)
+        std = np.sqrt(np.maximum(variance, 0.0))
+        return mean * self.scale + self.offset, std * self.scale
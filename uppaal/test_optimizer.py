@@ -0,0 +1,163 @@
+import os
+import stat
+import subprocess
+import sys
+
+import pytest
+
+from main import build_adg_very_simple
+from optimizer import NOT_FOUND, Optimizer, extract_formulas, strategy_results
+
+# Fake verifyta printing a block per formula of the model like verifyta -s: the
+# strategies listed in FAKE_UNSAT are not found, and FAKE_SLEEP (formula:seconds)
+# sleeps in the middle of the output of a formula.
+FAKE_VERIFYTA = """#!{python}
+import os, re, sys, time
+if "--version" in sys.argv:
+    print("UPPAAL fake")
+    sys.exit(0)
+formulas = re.findall(r"<formula>(.*?)</formula>", open(sys.argv[-1]).read(), re.S)
+unsat = os.environ.get("FAKE_UNSAT", "").split(",")
+sleep = dict(
+    map(float, item.split(":")) for item in os.environ.get("FAKE_SLEEP", "").split()
+)
+print("Options for the verification:\\n  Generating no trace\\n", flush=True)
+found = dict()
+for i, formula in enumerate(formulas, 1):
+    if not formula.strip():
+        continue
+    print(f"Verifying formula {{i}} at /nta/queries/query[{{i}}]/formula", flush=True)
+    time.sleep(sleep.get(i, 0))
+    strategy = re.match(r"strategy (\\w+)", formula)
+    if strategy:
+        found[strategy[1]] = strategy[1] not in unsat
+        print(
+            "\\x1b[2K -- Formula is satisfied."
+            if found[strategy[1]]
+            else "\\x1b[2K -- Formula is NOT satisfied."
+        )
+    elif not found[re.search(r"under (\\w+)", formula)[1]]:
+        print("\\x1b[K -- Formula is NOT satisfied.")
+    elif formula.startswith("E"):
+        print(
+            f"\\x1b[2K -- Formula is satisfied.\\n(10000 runs) E(max) = {{100 + i}} "
+            f"± 1.5 (95% CI)\\nValues in [1.5,{{300 + i}}] mean={{100 + i}} steps=4: "
+            f"10 20 30 {{i}}"
+        )
+    else:
+        print(
+            f"\\x1b[2K -- Formula is satisfied.\\n(10000 runs) Pr(<> ...) in "
+            f"[0.{{i}}1,0.{{i}}9]\\nwith confidence 0.95"
+        )
+    print(flush=True)
+"""
+
+FOUND = [
+    "Verifying formula 1 at /nta/queries/query[1]/formula",
+    " -- Formula is satisfied.",
+]
+E_TIME = [
+    "Verifying formula 2 at /nta/queries/query[2]/formula",
+    " -- Formula is satisfied.",
+    "(10000 runs) E(max) = 102 ± 1.5 (95% CI)",
+    "Values in [1.5,302] mean=102 steps=4: 10 20 30 2",
+]
+E_COST = [
+    "Verifying formula 3 at /nta/queries/query[3]/formula",
+    " -- Formula is satisfied.",
+    "(10000 runs) E(max) = 103 ± 1.5 (95% CI)",
+    "Values in [1.5,303] mean=103 steps=4: 10 20 30 3",
+]
+PROBABILITY = [
+    "Verifying formula 4 at /nta/queries/query[4]/formula",
+    " -- Formula is satisfied.",
+    "(10000 runs) Pr(<> ...) in [0.41,0.49]",
+    "with confidence 0.95",
+]
+RESULT = (
+    102.0,
+    103.0,
+    (0.41, 0.49, 0.95),
+    (1.5, 302.0, [10, 20, 30, 2]),
+    (1.5, 303.0, [10, 20, 30, 3]),
+)
+
+
+def test_strategy_results():
+    assert list(strategy_results([FOUND, E_TIME, E_COST, PROBABILITY])) == [RESULT]
+
+
+def test_strategy_not_found():
+    not_found = [FOUND[0], " -- Formula is NOT satisfied."]
+    outputs = [not_found, [" -- Formula is NOT satisfied."]] * 2
+    assert list(strategy_results(outputs + [FOUND, E_TIME, E_COST, PROBABILITY])) == [
+        NOT_FOUND,
+        RESULT,
+    ]
+
+
+@pytest.mark.parametrize(
+    "outputs",
+    [
+        [FOUND[:1]],
+        [FOUND, E_TIME],
+        [FOUND, E_TIME, E_COST, PROBABILITY[:1]],
+        [FOUND, E_TIME[:3], E_COST, PROBABILITY],
+    ],
+)
+def test_truncated_outputs(outputs):
+    assert list(strategy_results(outputs)) == []
+
+
+def test_extract_formulas_truncated():
+    formulas = ["Options", "\n".join(FOUND), "\n".join(PROBABILITY[:1])]
+    with pytest.raises(ValueError):
+        extract_formulas(formulas)
+
+
+@pytest.fixture
+def optimizer(tmp_path, monkeypatch):
+    verifyta = tmp_path / "verifyta"
+    verifyta.write_text(FAKE_VERIFYTA.format(python=sys.executable))
+    verifyta.chmod(verifyta.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(Optimizer, "verifyta_prefix", f"{tmp_path}{os.sep}")
+    monkeypatch.delenv("FAKE_SLEEP", raising=False)
+    monkeypatch.delenv("FAKE_UNSAT", raising=False)
+    optimizer = Optimizer(build_adg_very_simple(), cache_dir=tmp_path / "cache")
+    optimizer.export(str(tmp_path / "model.xml"))
+    return optimizer
+
+
+def test_verify(optimizer, monkeypatch):
+    result = optimizer.verify(optimizer.file_name, time_limit=100)
+    assert result[:3] == (102.0, 103.0, (0.41, 0.49, 0.95))
+    monkeypatch.setenv("FAKE_UNSAT", "limited_cost")
+    assert optimizer.verify(optimizer.file_name, cost_limit=400) == NOT_FOUND
+
+
+@pytest.mark.parametrize("formula", [1, 4])
+def test_timeout_is_not_cached(optimizer, monkeypatch, formula):
+    monkeypatch.setenv("FAKE_SLEEP", f"{formula}:10")
+    with pytest.raises(subprocess.TimeoutExpired):
+        optimizer.verify(optimizer.file_name, time_limit=100, timeout=1)
+    (result,) = optimizer.verify_many([{"time_limit": 100}], timeout=1)
+    assert isinstance(result, subprocess.TimeoutExpired)
+    results = optimizer.verify_limits(
+        optimizer.file_name, [(100, None), (None, 400)], timeout=1
+    )
+    assert all(isinstance(result, subprocess.TimeoutExpired) for result in results)
+    monkeypatch.delenv("FAKE_SLEEP")
+    result = optimizer.verify(optimizer.file_name, time_limit=100)
+    assert result[:3] == (102.0, 103.0, (0.41, 0.49, 0.95))
+
+
+def test_cached_results(optimizer):
+    optimizer.verify(optimizer.file_name, time_limit=100)
+    hits, misses = optimizer.cache.hits, optimizer.cache.misses
+    names = [defense.name for defense in optimizer.adg.defenses]
+    (result,) = optimizer.cached_results(names, (1, 10**6), 10000, 100, None)
+    assert result[1][:3] == (102.0, 103.0, (0.41, 0.49, 0.95))
+    assert (optimizer.cache.hits, optimizer.cache.misses) == (hits, misses)
+    optimizer.exporter = None
+    with pytest.raises(ValueError):
+        optimizer.cached_results(names, (1, 10**6), 10000, 100, None)
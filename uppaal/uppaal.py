@@ -1,3 +1,5 @@
+import hashlib
+import os
 import xml.etree.ElementTree as etree
 from admdp import ADMDP, StateType, EdgeType
 from adg import ADG, Subgoal, Attack, Defense, OperationType
@@ -20,18 +22,31 @@ def list_to_string(names, prefix="", values=None, format_values=None):
     return string
 
 
+def copy_chunks(source, output, length):
+    """Copy length bytes from the source binary file to the output one."""
+    while length > 0:
+        chunk = source.read(min(length, 1 << 20))
+        if not chunk:
+            break
+        output.write(chunk)
+        length -= len(chunk)
+
+
 class UppaalExporter:
     output_file = None
-    state_id = 0
-    id_to_serial = dict()
-    serial_to_id = dict()
-    serial_to_position = dict()
-    serial_to_location_name = dict()
     dx, dy, lx = 100, 100, 8
 
-    def __init__(self, admdp, output_file_name):
+    def __init__(self, admdp, output_file_name, adg=None, goal_name=None):
+        """admdp can be None if the template is given to make_xml, with the adg and
+        the location name of the goal."""
         self.admdp = admdp
+        self.adg = adg if adg is not None else admdp.adg
+        self.goal_name = goal_name
         self.output_file_name = output_file_name
+        self.state_id = 0
+        self.id_to_key = dict()
+        self.key_to_id = dict()
+        self.key_to_position = dict()
 
     def open_file(self, mode="w"):
         self.output_file = open(self.output_file_name, mode)
@@ -39,68 +54,184 @@ class UppaalExporter:
     def close_file(self):
         self.output_file.close()
 
-    def make_xml(self, simulation_number=10000, time_limit=1000, cost_limit=400):
-        """XML file interpretable by Uppaal Stratego."""
+    def make_xml(
+        self,
+        simulation_number=10000,
+        time_limit=1000,
+        cost_limit=400,
+        stream=False,
+        pretty=True,
+        template=None,
+    ):
+        """XML file interpretable by Uppaal Stratego. With stream, the elements are
+        written to the file as soon as they are made instead of building the whole
+        tree in memory. pretty indents the XML as etree.indent does. template is a file
+        saved by save_template to copy instead of making the template."""
+        self.stream = stream
+        self.pretty = pretty
+        self.nta = etree.Element("nta")
+        self.declaration_xml = self.render_declaration()
+        self.queries_xml = self.render_queries(
+            simulation_number, time_limit, cost_limit
+        )
         self.open_file()
-        self.output_file.write('<?xml version="1.0" encoding="utf-8"?>\n')
-        self.output_file.write(
+        self.output_file.write(self.header())
+        self.output_file.write(self.declaration_xml)
+        # The template and the system never change, their position is kept to copy
+        # them when the declaration or the queries are updated
+        template_start = self.output_file.tell()
+        if template:
+            self.output_file.flush()
+            with open(template, "rb") as template_file:
+                copy_chunks(
+                    template_file, self.output_file.buffer, os.path.getsize(template)
+                )
+        else:
+            self.make_templates()
+            system = etree.SubElement(self.nta, "system")
+            system.text = "system AttackDefenseADMDP;"
+            self.output_file.write(self.render(self.nta, level=1))
+        self.template_span = (template_start, self.output_file.tell())
+        self.template_hash = None
+        self.output_file.write(self.queries_xml)
+        self.output_file.write(self.footer())
+        self.close_file()
+
+    def header(self):
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
             "<!DOCTYPE nta PUBLIC '-//Uppaal Team//DTD Flat System 1.1//EN' 'http://www.it.uu.se/research/group/darts/uppaal/flat-1_2.dtd'>\n"
+            "<nta>"
         )
-        self.nta = etree.Element("nta")
-        self.make_declaration()
-        self.make_templates()
-        system = etree.SubElement(self.nta, "system")
-        system.text = "system AttackDefenseADMDP;"
+
+    def footer(self):
+        return f"{self.indentation(0)}</nta>"
+
+    def indentation(self, level):
+        return "\n" + "\t" * level if self.pretty else ""
+
+    def render(self, parent, level):
+        """XML of the children of parent (of depth level in the nta tree). They are
+        removed from the tree."""
+        xml = ""
+        for element in parent:
+            if self.pretty:
+                etree.indent(element, space="\t", level=level)
+            xml += self.indentation(level)
+            xml += etree.tostring(
+                element, encoding="unicode", short_empty_elements=False
+            )
+        parent.clear()
+        return xml
+
+    def flush(self, parent, level):
+        """In stream mode, write the children of parent (of depth level in the nta
+        tree) to the file and remove them from the tree."""
+        if self.stream:
+            self.output_file.write(self.render(parent, level))
+
+    def render_declaration(self, times=None):
+        self.make_declaration(times)
+        return self.render(self.nta, level=1)
+
+    def render_queries(self, simulation_number=10000, time_limit=None, cost_limit=None):
         self.make_queries(simulation_number, time_limit, cost_limit)
-        etree.indent(self.nta, space="\t", level=0)
-        self.output_file.write(
-            etree.tostring(self.nta, encoding="unicode", short_empty_elements=False)
+        return self.render(self.nta, level=1)
+
+    def render_batch_queries(self, limits, simulation_number=10000):
+        """Queries of several limits (pairs of time limit and cost limit) in a single
+        queries element, the strategies of the i-th limit being suffixed by _i."""
+        queries = etree.SubElement(self.nta, "queries")
+        for i, (time_limit, cost_limit) in enumerate(limits):
+            self.make_queries(
+                simulation_number,
+                time_limit,
+                cost_limit,
+                queries=queries,
+                suffix=f"_{i}",
+            )
+        return self.render(self.nta, level=1)
+
+    def write_model(
+        self, declaration_xml=None, queries_xml=None, output_file_name=None
+    ):
+        """Write the model with the given declaration and queries (the current ones by
+        default) to output_file_name (the exported file by default). The template and
+        the system are copied from the exported file without parsing it."""
+        declaration_xml = declaration_xml or self.declaration_xml
+        queries_xml = queries_xml or self.queries_xml
+        output_file_name = output_file_name or self.output_file_name
+        in_place = os.path.abspath(output_file_name) == os.path.abspath(
+            self.output_file_name
         )
-        self.close_file()
+        temporary_file_name = (
+            f"{output_file_name}.tmp" if in_place else output_file_name
+        )
+        template_start, template_end = self.template_span
+        with open(self.output_file_name, "rb") as model, open(
+            temporary_file_name, "wb"
+        ) as output:
+            output.write((self.header() + declaration_xml).encode())
+            start = output.tell()
+            model.seek(template_start)
+            copy_chunks(model, output, template_end - template_start)
+            end = output.tell()
+            output.write((queries_xml + self.footer()).encode())
+        if in_place:
+            os.replace(temporary_file_name, output_file_name)
+            self.template_span = (start, end)
+
+    def template_digest(self):
+        """Hash of the template and system part of the exported file."""
+        if self.template_hash is None:
+            digest = hashlib.sha256()
+            template_start, template_end = self.template_span
+            with open(self.output_file_name, "rb") as model:
+                model.seek(template_start)
+                remaining = template_end - template_start
+                while remaining > 0:
+                    chunk = model.read(min(remaining, 1 << 20))
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+            self.template_hash = digest.hexdigest()
+        return self.template_hash
+
+    def save_template(self, file_name):
+        """Save the template and system part of the exported file (see make_xml)."""
+        template_start, template_end = self.template_span
+        with open(self.output_file_name, "rb") as model, open(
+            file_name, "wb"
+        ) as output:
+            model.seek(template_start)
+            copy_chunks(model, output, template_end - template_start)
 
     def set_queries(self, simulation_number=10000, time_limit=None, cost_limit=None):
-        self.open_file(mode="r")
-        system = etree.parse(self.output_file)
-        self.close_file()
-        self.nta = system.getroot()
-        self.nta.remove(system.find("queries"))
-        self.open_file(mode="w")
-        self.make_queries(simulation_number, time_limit, cost_limit)
-        etree.indent(self.nta, space="\t", level=0)
-        self.output_file.write(
-            etree.tostring(self.nta, encoding="unicode", short_empty_elements=False)
+        self.queries_xml = self.render_queries(
+            simulation_number, time_limit, cost_limit
         )
-        self.close_file()
+        self.write_model()
 
     def set_defense_times(self, times):
-        self.open_file(mode="r")
-        system = etree.parse(self.output_file)
-        self.close_file()
-        self.nta = system.getroot()
-        self.open_file(mode="w")
-        self.make_declaration(remake=True)
-        etree.indent(self.nta, space="\t", level=0)
-        self.output_file.write(
-            etree.tostring(self.nta, encoding="unicode", short_empty_elements=False)
-        )
-        self.close_file()
-
-    def make_declaration(self, remake=False):
-        """Declaration section of Uppaal."""
-        adg = self.admdp.adg
+        """Rewrite the model with the periods of times overriding those of the ADG
+        (see make_declaration)."""
+        self.declaration_xml = self.render_declaration(times)
+        self.write_model()
+
+    def make_declaration(self, times=None):
+        """Declaration section of Uppaal. times overrides the periods of the defenses
+        (a dictionary with names of the defenses as key)."""
+        adg = self.adg
         attack_names = [attack.name for attack in adg.attacks]
         defense_names = [defense.name for defense in adg.defenses]
         t_a = [attack.completion_time for attack in adg.attacks]
         p_a = [attack.success_probability for attack in adg.attacks]
         c_a = [attack.activation_cost for attack in adg.attacks]
         cp_a = [attack.proportional_cost for attack in adg.attacks]
-        t_d = [defense.period for defense in adg.defenses]
+        times = times if times else dict()
+        t_d = [times.get(defense.name, defense.period) for defense in adg.defenses]
         p_d = [defense.success_probability for defense in adg.defenses]
 
-        if remake:
-            declaration = self.nta.find("declaration")
-        else:
-            declaration = etree.SubElement(self.nta, "declaration")
+        declaration = etree.SubElement(self.nta, "declaration")
         declaration.text = f"""const int n_a = {len(adg.attacks)};
 const int n_d = {len(adg.defenses)};
 hybrid clock time;
@@ -127,7 +258,12 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
 
     def make_templates(self):
         """The unic template of our uppaal model."""
-        template = etree.SubElement(self.nta, "template")
+        if self.stream:
+            # The template children are flushed, only its tags are written here
+            self.output_file.write(f"{self.indentation(1)}<template>")
+            template = etree.Element("template")
+        else:
+            template = etree.SubElement(self.nta, "template")
         template_name = etree.SubElement(template, "name")
         template_name.set("x", "0")
         template_name.set("y", "0")
@@ -144,28 +280,32 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
                 state_id = self.make_location(state, template)
                 if state_id:
                     initial_state_id = state_id
+                self.flush(template, level=2)
         for state in states.values():
             if (
                 state.state_type == StateType.MTD
                 or state.state_type == StateType.COMPLETION
             ):
                 self.make_branchpoint(state, template)
+                self.flush(template, level=2)
         initial = etree.SubElement(template, "init")
+        initial.set("ref", initial_state_id)
         for state in states.values():
             for edge in state.edges:
                 self.make_transition(edge, template)
-
-        initial.set("ref", initial_state_id)
+            self.flush(template, level=2)
+        if self.stream:
+            self.output_file.write(f"{self.indentation(1)}</template>")
 
     def make_location(self, state, template):
         """Locations of the template."""
-        self.serial_to_id[state.serialize()] = f"id{self.state_id}"
-        self.id_to_serial[f"id{self.state_id}"] = state.serialize()
+        self.key_to_id[state.key] = f"id{self.state_id}"
+        self.id_to_key[f"id{self.state_id}"] = state.key
         location_x, location_y = (
             self.dx * (self.state_id // self.lx),
             self.dy * (self.state_id % self.lx),
         )
-        self.serial_to_position[state.serialize()] = (location_x, location_y)
+        self.key_to_position[state.key] = (location_x, location_y)
 
         location = etree.SubElement(template, "location")
         location.set("id", f"id{self.state_id}")
@@ -174,11 +314,7 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
         location_name = etree.SubElement(location, "name")
         location_name.set("x", str(location_x - 50))
         location_name.set("y", str(location_y - 34))
-        location_name.text = "__".join(
-            e if type(e) is str else "_".join(str(sub_elem) for sub_elem in e)
-            for e in state.serialize()
-        )
-        self.serial_to_location_name[state.serialize()] = location_name.text
+        location_name.text = self.location_name(state)
         self.make_label(state, location, location_x, location_y)
 
         initial_state_id = f"id{self.state_id}" if state.initial else None
@@ -186,14 +322,20 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
         self.state_id += 1
         return initial_state_id
 
+    def location_name(self, state):
+        return "__".join(
+            e if type(e) is str else "_".join(str(sub_elem) for sub_elem in e)
+            for e in state.serialize()
+        )
+
     def make_branchpoint(self, state, template):
-        self.serial_to_id[state.serialize()] = f"id{self.state_id}"
-        self.id_to_serial[f"id{self.state_id}"] = state.serialize()
+        self.key_to_id[state.key] = f"id{self.state_id}"
+        self.id_to_key[f"id{self.state_id}"] = state.key
         branchpoint_x, branchpoint_y = (
             self.dx * (self.state_id // self.lx),
             self.dy * (self.state_id % self.lx),
         )
-        self.serial_to_position[state.serialize()] = (branchpoint_x, branchpoint_y)
+        self.key_to_position[state.key] = (branchpoint_x, branchpoint_y)
 
         branchpoint = etree.SubElement(template, "branchpoint")
         branchpoint.set("id", f"id{self.state_id}")
@@ -225,23 +367,27 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             # Make proportial cost invariant
             invariant = "cost' =="
             cost_connector = " "
-            for attack in state.activated:
+            for attack in self.adg.unmask(state.activated):
                 if attack.proportional_cost is not None:
                     invariant += f"{cost_connector}cp_{attack.name}"
                     cost_connector = " + "
             if cost_connector == " ":
                 invariant += " 0"
-            # Make defense clocks guards
-            for defense in self.admdp.adg.defenses:
-                invariant += f" &&\nx_{defense.name} <= t_{defense.name}"
+            # Make defense clocks guards, but for the defenses that don't matter
+            for defense in self.adg.defenses:
+                if (
+                    state.relevant_defenses is None
+                    or state.relevant_defenses & self.adg.bit(defense)
+                ):
+                    invariant += f" &&\nx_{defense.name} <= t_{defense.name}"
             # Make active attacks clocks guards
-            for activated in state.activated:
+            for activated in self.adg.unmask(state.activated):
                 invariant += f" &&\nx_{activated.name} <= t_{activated.name}"
         elif state.state_type == StateType.ACTIVATION_COST:
             invariant = f"time' == 0 &&\nxcost <= 1 &&\ncost' == c_{state.attack.name}"
-            for attack in self.admdp.adg.attacks:
+            for attack in self.adg.attacks:
                 invariant += f" &&\nx_{attack.name}' == 0"
-            for defense in self.admdp.adg.defenses:
+            for defense in self.adg.defenses:
                 invariant += f" &&\nx_{defense.name}' == 0"
 
         label.text = invariant
@@ -249,15 +395,15 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
     def make_transition(self, edge, template):
         transition = etree.SubElement(template, "transition")
         source = etree.SubElement(
-            transition, "source", {"ref": self.serial_to_id[edge.source.serialize()]}
+            transition, "source", {"ref": self.key_to_id[edge.source.key]}
         )
         target = etree.SubElement(
             transition,
             "target",
-            {"ref": self.serial_to_id[edge.destination.serialize()]},
+            {"ref": self.key_to_id[edge.destination.key]},
         )
-        source_x, source_y = self.serial_to_position[edge.source.serialize()]
-        target_x, target_y = self.serial_to_position[edge.destination.serialize()]
+        source_x, source_y = self.key_to_position[edge.source.key]
+        target_x, target_y = self.key_to_position[edge.destination.key]
         label_x, label_y = (source_x + target_x) // 2, (source_y + target_y) // 2
         if edge.type == EdgeType.ACTIVATION:
             label = etree.SubElement(
@@ -342,36 +488,51 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             label.text = "xcost = 0"
 
     def make_queries(
-        self, simulation_number=10000, time_limit=None, cost_limit=None, infinity=100000
+        self,
+        simulation_number=10000,
+        time_limit=None,
+        cost_limit=None,
+        infinity=100000,
+        queries=None,
+        suffix="",
     ):
-        """Uppaal and Stratego queries on the model."""
-        goal_name = self.serial_to_location_name[self.admdp.accepting_state.serialize()]
-        goal_name = "AttackDefenseADMDP." + goal_name
-        queries = etree.SubElement(self.nta, "queries")
+        """Uppaal and Stratego queries on the model, added to the queries element if
+        given. suffix is appended to the names of the strategies."""
+        if self.goal_name is None:
+            self.goal_name = self.location_name(self.admdp.accepting_state)
+        goal_name = "AttackDefenseADMDP." + self.goal_name
+        if queries is None:
+            queries = etree.SubElement(self.nta, "queries")
 
         # Fast strategy
         if time_limit is None and cost_limit is None:
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
-            formula.text = f"strategy fast = minE(time)[time<=10000]: <>{goal_name}"
+            formula.text = (
+                f"strategy fast{suffix} = minE(time)[time<=10000]: <>{goal_name}"
+            )
             comment = etree.SubElement(query, "comment")
             comment.text = "Fast strategy"
             # Expected time under fast
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
-            formula.text = f"E[time<=10000;{simulation_number}](max: time) under fast"
+            formula.text = (
+                f"E[time<=10000;{simulation_number}](max: time) under fast{suffix}"
+            )
             comment = etree.SubElement(query, "comment")
             comment.text = "Expected time under fast"
             # Expected cost under fast
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
-            formula.text = f"E[time<=10000;{simulation_number}](max: cost) under fast"
+            formula.text = (
+                f"E[time<=10000;{simulation_number}](max: cost) under fast{suffix}"
+            )
             comment = etree.SubElement(query, "comment")
             comment.text = "Expected cost under fast"
             # Success probability under fast
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
-            formula.text = f"Pr[time<=100](<>{goal_name}) under fast"
+            formula.text = f"Pr[time<=100](<>{goal_name}) under fast{suffix}"
             comment = etree.SubElement(query, "comment")
             comment.text = "Success probability under fast"
 
@@ -380,7 +541,8 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
             formula.text = (
-                f"strategy cheap = minE(cost)[time<={time_limit}]: <>{goal_name}"
+                f"strategy cheap{suffix} = minE(cost)[time<={time_limit}]: "
+                f"<>{goal_name}"
             )
             comment = etree.SubElement(query, "comment")
             comment.text = "Cheap strategy"
@@ -388,7 +550,8 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
             formula.text = (
-                f"E[time<={infinity};{simulation_number}](max: time) under cheap"
+                f"E[time<={infinity};{simulation_number}](max: time) "
+                f"under cheap{suffix}"
             )
             comment = etree.SubElement(query, "comment")
             comment.text = "Expected time under cheap"
@@ -396,14 +559,15 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
             formula.text = (
-                f"E[time<={infinity};{simulation_number}](max: cost) under cheap"
+                f"E[time<={infinity};{simulation_number}](max: cost) "
+                f"under cheap{suffix}"
             )
             comment = etree.SubElement(query, "comment")
             comment.text = "Expected cost under cheap"
             # Success probability under cheap
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
-            formula.text = f"Pr[time<={time_limit}](<>{goal_name}) under cheap"
+            formula.text = f"Pr[time<={time_limit}](<>{goal_name}) under cheap{suffix}"
             comment = etree.SubElement(query, "comment")
             comment.text = "Success probability under cheap"
 
@@ -416,7 +580,8 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
             formula.text = (
-                f"strategy limited_cost = minE(time)[cost<={cost_limit}]: <>{goal_name}"
+                f"strategy limited_cost{suffix} = minE(time)[cost<={cost_limit}]: "
+                f"<>{goal_name}"
             )
             comment = etree.SubElement(query, "comment")
             comment.text = "Limited cost fastest strategy"
@@ -424,7 +589,8 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
             formula.text = (
-                f"E[cost<={infinity};{simulation_number}](max: time) under limited_cost"
+                f"E[cost<={infinity};{simulation_number}](max: time) "
+                f"under limited_cost{suffix}"
             )
             comment = etree.SubElement(query, "comment")
             comment.text = "Expected time under limited cost"
@@ -432,14 +598,17 @@ const double {list_to_string(defense_names, prefix='p_', values=p_d, format_valu
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
             formula.text = (
-                f"E[cost<={infinity};{simulation_number}](max: cost) under limited_cost"
+                f"E[cost<={infinity};{simulation_number}](max: cost) "
+                f"under limited_cost{suffix}"
             )
             comment = etree.SubElement(query, "comment")
             comment.text = "Expected cost under limited cost"
             # Success probability under cheap
             query = etree.SubElement(queries, "query")
             formula = etree.SubElement(query, "formula")
-            formula.text = f"Pr[cost<={cost_limit}](<>{goal_name}) under limited_cost"
+            formula.text = (
+                f"Pr[cost<={cost_limit}](<>{goal_name}) under limited_cost{suffix}"
+            )
             comment = etree.SubElement(query, "comment")
             comment.text = "Success probability under limited_cost"
 